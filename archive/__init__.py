@@ -0,0 +1,256 @@
+# Single file archives of whole batches
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+import numpy as np
+from image import encode_schematic, input_name
+from karnaugh import KarnaughMap, Netlist, create_map_array, format_kmap, generate_index, map_from_table, split_gates, \
+    truth_table
+from metrics import count
+from schematic import place_gates
+from settings import OUTPUT_FOLDER
+from writer import replacing
+
+# Constants
+COPY_CHUNK = 2 ** 24  # Bytes copied from a column into the archive at once
+
+
+def archive_path(filename: str) -> str:
+
+    """Returns the path of the archive for a batch."""
+
+    return f"{OUTPUT_FOLDER}/{filename}.npz"
+
+
+def write_column(archive: zipfile.ZipFile, name: str, column, dtype: np.dtype, shape: tuple):
+
+    """Writes raw array data from an open file into the archive as an uncompressed .npy member."""
+
+    column.seek(0)
+
+    with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+        np.lib.format.write_array_header_2_0(member, {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": shape
+        })
+        shutil.copyfileobj(column, member, COPY_CHUNK)
+
+
+class ArchiveWriter:
+
+    """
+    Collects a whole batch into one uncompressed .npz file instead of a pair of files per version. Holds the base grid
+    and netlist, the gate symbols and packed truth table of every version, the Karnaugh map axis labels, and optionally
+    the encoded PNG of every version with an offset index. Versions are appended to temporary columns as they stream
+    past, and the archive is put together when the writer is closed. The number of versions in the whole job is kept
+    too when given, so the archive of a shard can be checked for missing versions.
+    """
+
+    def __init__(self, path: str, grid: np.ndarray, netlist: Netlist, total=None):
+
+        self.path = path
+        self.grid = grid
+        self.netlist = netlist
+        self.total = total  # Versions in the whole job, if known
+        self.versions = 0
+        self.table_shape = None  # Words of a truth table, once one is added
+        self.image_sizes = []  # Bytes in each image, in version order
+
+        # Each column is appended to as versions arrive, so only the current version is held in memory
+        self.columns = {name: tempfile.TemporaryFile() for name in ("index", "gates", "tables", "png")}
+
+    def add_grid(self, index: int, grid: np.ndarray):
+
+        """Records a version's index and gates. Versions must be added in the order they will be read."""
+
+        rows, columns = zip(*self.netlist.gates)
+        self.add_gates(index, grid[rows, columns])
+
+    def add_gates(self, index: int, gates: np.ndarray):
+
+        """Records a version's index and the symbols of its gates, in netlist order."""
+
+        self.columns["index"].write(np.int64(index).tobytes())
+        self.columns["gates"].write(np.ascontiguousarray(gates, dtype=np.uint8).tobytes())
+        self.versions += 1
+
+    def add_table(self, table: np.ndarray):
+
+        """Records the packed truth table of the next version."""
+
+        self.table_shape = table.shape
+        self.columns["tables"].write(np.ascontiguousarray(table, dtype=np.uint64).tobytes())
+
+    def add_image(self, image: bytes):
+
+        """Records the encoded PNG of the next version."""
+
+        self.columns["png"].write(image)
+        self.image_sizes.append(len(image))
+
+    def stream(self, grids):
+
+        """Records the gates of each (index, grid, table) passed, and yields them on."""
+
+        for index, grid, table in grids:
+            self.add_grid(index, grid)
+            yield index, grid, table
+
+    def close(self):
+
+        """Puts the archive together from its columns, replacing any archive already at its path."""
+
+        inputs = self.netlist.inputs
+
+        with replacing(self.path) as temporary, \
+                zipfile.ZipFile(temporary, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+
+            # Layout shared by every version
+            for name, array in (
+                ("grid", np.asarray(self.grid)),
+                ("gate_coords", np.array(self.netlist.gates, dtype=np.int32)),
+                ("children", np.asarray(self.netlist.children)),
+                ("inputs", np.array([input_name(_) for _ in range(inputs)]))
+            ):
+                with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array(member, array)
+
+            if self.total is not None:
+                with archive.open("total.npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array(member, np.array(self.total, dtype=np.int64))
+
+            write_column(archive, "index", self.columns["index"], np.dtype(np.int64), (self.versions,))
+            write_column(archive, "gates", self.columns["gates"], np.dtype(np.uint8),
+                         (self.versions, len(self.netlist.gates)))
+
+            if self.table_shape is not None:  # Truth tables were evaluated
+
+                top, left = split_gates(inputs)
+                for name, labels in (("left_labels", generate_index(left)), ("top_labels", generate_index(top))):
+                    with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                        np.lib.format.write_array(member, np.array(labels))
+
+                write_column(archive, "tables", self.columns["tables"], np.dtype(np.uint64),
+                             (self.versions, *self.table_shape))
+
+            if self.image_sizes:  # Images were encoded
+
+                offsets = np.zeros(len(self.image_sizes) + 1, dtype=np.int64)
+                np.cumsum(self.image_sizes, out=offsets[1:])
+                with archive.open("png_offsets.npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array(member, offsets)
+
+                write_column(archive, "png", self.columns["png"], np.dtype(np.uint8), (int(offsets[-1]),))
+
+        for column in self.columns.values():
+            column.close()
+
+        count("files_written")
+        count("bytes_written", os.path.getsize(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def member_array(path: str, archive: zipfile.ZipFile, name: str) -> np.ndarray:
+
+    """Returns a member of an uncompressed .npz file memory mapped read-only, so reading it doesn't load it all."""
+
+    info = archive.getinfo(f"{name}.npy")
+
+    with open(path, "rb") as file:
+
+        # The member's data follows its local header, whose name and extra field lengths are its last two fields
+        file.seek(info.header_offset)
+        name_length, extra_length = struct.unpack("<26xHH", file.read(30))
+        file.seek(info.header_offset + 30 + name_length + extra_length)
+
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+
+    if dtype.hasobject or not np.prod(shape):  # Can't be mapped, and small enough to load
+        with archive.open(info) as member:
+            return np.load(member)
+
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
+
+
+class ArchiveReader:
+
+    """Random access to the versions of an archive, by their version number (index + 1)."""
+
+    def __init__(self, path: str):
+
+        self.path = path
+
+        with zipfile.ZipFile(path) as archive:
+            self.arrays = {
+                name.removesuffix(".npy"): member_array(path, archive, name.removesuffix(".npy"))
+                for name in archive.namelist()
+            }
+
+        self.grid = self.arrays["grid"]
+        self.netlist = Netlist(
+            len(self.arrays["inputs"]),
+            [(row, column) for row, column in self.arrays["gate_coords"].tolist()],
+            self.arrays["children"]
+        )
+        self.numbers = {index + 1: _ for _, index in enumerate(self.arrays["index"].tolist())}
+        self.total = int(self.arrays["total"]) if "total" in self.arrays else None  # Versions in the whole job
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def __contains__(self, number: int) -> bool:
+        return number in self.numbers
+
+    def schematic(self, number: int) -> np.ndarray:
+
+        """Returns the grid of a version."""
+
+        return place_gates(self.grid, self.netlist.gates, self.arrays["gates"][self.numbers[number]])
+
+    def table(self, number: int) -> np.ndarray:
+
+        """Returns the packed truth table of a version, evaluating it if the archive doesn't hold truth tables."""
+
+        if "tables" in self.arrays:
+            return np.array(self.arrays["tables"][self.numbers[number]])
+
+        return truth_table(self.netlist, self.schematic(number))
+
+    def kmap(self, number: int) -> KarnaughMap:
+
+        """Returns the Karnaugh map of a version."""
+
+        return map_from_table(create_map_array(self.netlist.inputs), self.table(number), self.netlist.inputs)
+
+    def worksheet(self, number: int) -> str:
+
+        """Returns the Karnaugh map of a version as the text of its file."""
+
+        return format_kmap(self.kmap(number))
+
+    def image(self, number: int, scalar=1, renderer="paste") -> bytes:
+
+        """Returns the PNG of a version, rendered with the scalar and renderer if the archive doesn't hold images."""
+
+        if "png" in self.arrays:
+            offsets = self.arrays["png_offsets"]
+            position = self.numbers[number]
+            return self.arrays["png"][offsets[position]:offsets[position + 1]].tobytes()
+
+        return encode_schematic(self.schematic(number), number - 1, scalar, renderer)
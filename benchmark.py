@@ -0,0 +1,32 @@
+# Benchmarks every stage of the pipeline
+__author__ = "Matteo Golin"
+
+# Imports
+import sys
+from commands import benchmark_parser
+from settings import INPUT_LETTERS
+
+# Program parameters
+arguments = benchmark_parser.parse_args()
+
+# Karnaugh maps are timed too, which only go up to the single letter inputs
+if max(arguments.i) > INPUT_LETTERS:
+    benchmark_parser.error(f"input counts can't be above {INPUT_LETTERS} (GOT: {max(arguments.i)})")
+
+# The benchmarks are only imported once the arguments are read, so -h doesn't wait for them
+from benchmarks import run_benchmarks, save_results, load_results, compare_results
+
+results = run_benchmarks(arguments.i, arguments.v, arguments.seed, arguments.repeats, arguments.order)
+save_results(results, arguments.o)
+print(f"\nResults saved to {arguments.o}")
+
+if arguments.compare:
+
+    print(f"\nCompared to {arguments.compare}:")
+    regressions = compare_results(results, load_results(arguments.compare), arguments.threshold)
+
+    if regressions:
+        print(f"\n{len(regressions)} stages regressed by more than {arguments.threshold:.0%}.")
+        sys.exit(1)
+
+    print("\nNo regressions.")
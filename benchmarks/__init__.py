@@ -0,0 +1,203 @@
+# Timing every stage of the pipeline
+__author__ = "Matteo Golin"
+
+# Imports
+import io
+import json
+import platform
+import tempfile
+import time
+import numpy as np
+import PIL
+import image
+from karnaugh import compile_netlist, create_map_array, gate_code_matrix, incremental_evaluator, kmap_batch_size, \
+    kmap_text, map_from_table, truth_table_batch
+from schematic import create_grid, wire_grid, get_gate_coords, grid_stream, seed_key
+from settings import RENDERERS
+
+# Constants
+BENCHMARK_FILE = "benchmark.json"
+REPEATS = 3  # Each stage is timed this many times, and the fastest is kept
+THRESHOLD = 0.25  # Slowdown over the baseline that counts as a regression
+NOISE_FLOOR = 0.005  # Seconds that a stage must slow down by, so very quick stages don't flag on noise
+
+
+def best_time(function, repeats=REPEATS) -> tuple[float, object]:
+
+    """Calls the function the number of times given, and returns its fastest time in seconds and its last result."""
+
+    fastest = float("inf")
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        fastest = min(fastest, time.perf_counter() - start)
+
+    return fastest, result
+
+
+def layout(inputs: int) -> np.ndarray:
+
+    """Creates and wires a base grid."""
+
+    grid = create_grid(inputs)
+    wire_grid(grid)
+
+    return grid
+
+
+def sample(grid: np.ndarray, versions: int, seed: int, order="random") -> list[np.ndarray]:
+
+    """Draws the versions of a base grid, the same ones every time for the same seed."""
+
+    return [new_grid for _, new_grid, _ in grid_stream(grid, versions, order=order, key=seed_key(seed))]
+
+
+def evaluate(netlist, grids: list[np.ndarray]) -> list[np.ndarray]:
+
+    """Evaluates the truth tables of the versions the way the pipeline would, in batches or incrementally."""
+
+    evaluator = incremental_evaluator(netlist)
+    if evaluator is not None:
+        return [evaluator.table(codes) for codes in gate_code_matrix(netlist, grids)]
+
+    batch_size = kmap_batch_size(netlist.inputs)
+    tables = []
+
+    for start in range(0, len(grids), batch_size):
+        tables.extend(truth_table_batch(netlist, gate_code_matrix(netlist, grids[start:start + batch_size])))
+
+    return tables
+
+
+def write_kmaps(kmaps: list) -> int:
+
+    """Writes the text of each Karnaugh map to a temporary file, and returns the number of characters written."""
+
+    written = 0
+
+    for kmap in kmaps:
+        with tempfile.TemporaryFile("w") as file:
+            for text in kmap_text(kmap):
+                written += file.write(text)
+
+    return written
+
+
+def render(grids: list[np.ndarray], renderer: str) -> list:
+
+    """Renders the versions, starting from empty caches so the static layer is drawn once per run."""
+
+    image.STATIC_LAYERS.clear()
+
+    return [image.RENDER_FUNCTIONS[renderer](grid, index) for index, grid in enumerate(grids)]
+
+
+def encode(images: list) -> int:
+
+    """Encodes the images as PNG files in memory, and returns the total size."""
+
+    size = 0
+
+    for _ in images:
+        encoded = io.BytesIO()
+        _.save(encoded, "PNG")
+        size += encoded.tell()
+
+    return size
+
+
+def run_benchmarks(input_counts: list[int], version_counts: list[int], seed=0, repeats=REPEATS,
+                   order="random") -> dict:
+
+    """
+    Times each stage of the pipeline for every combination of input count and version count, and returns the results
+    with a description of the machine. Stages that only depend on the layout are timed once per input count, with no
+    version count.
+    """
+
+    results = []
+
+    def record(stage: str, inputs: int, versions, function):
+
+        seconds, result = best_time(function, repeats)
+        results.append({"stage": stage, "inputs": inputs, "versions": versions, "seconds": seconds})
+        print(f"{stage:>16} {inputs:>3} inputs {versions or '-':>6} versions {seconds:10.4f}s")
+
+        return result
+
+    for inputs in input_counts:
+
+        grid = record("layout", inputs, None, lambda: layout(inputs))
+        netlist = record("netlist", inputs, None, lambda: compile_netlist(grid, get_gate_coords(grid)))
+        kmap = create_map_array(inputs)
+
+        for versions in version_counts:
+
+            grids = record("sampling", inputs, versions, lambda: sample(grid, versions, seed, order))
+            tables = record("truth_tables", inputs, versions, lambda: evaluate(netlist, grids))
+            kmaps = record("kmap_population", inputs, versions,
+                           lambda: [map_from_table(kmap, table, inputs) for table in tables])
+            record("kmap_text", inputs, versions, lambda: write_kmaps(kmaps))
+            del kmaps  # Large maps are held in temporary files
+
+            for renderer in RENDERERS:
+                images = record(f"render_{renderer}", inputs, versions, lambda: render(grids, renderer))
+            record("png_encode", inputs, versions, lambda: encode(images))
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "machine": platform.platform(),
+        "seed": seed,
+        "order": order,
+        "repeats": repeats,
+        "results": results
+    }
+
+
+def save_results(results: dict, path=BENCHMARK_FILE):
+
+    """Saves benchmark results as JSON."""
+
+    with open(path, "w") as file:
+        json.dump(results, file, indent=4)
+
+
+def load_results(path=BENCHMARK_FILE) -> dict:
+
+    """Loads benchmark results saved as JSON."""
+
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare_results(results: dict, baseline: dict, threshold=THRESHOLD) -> list[dict]:
+
+    """
+    Prints how each timing compares to the same stage, input count and version count in the baseline, and returns the
+    timings that are slower by more than the threshold (a fraction of the baseline time) and the noise floor.
+    """
+
+    previous = {(_["stage"], _["inputs"], _["versions"]): _["seconds"] for _ in baseline["results"]}
+    regressions = []
+
+    for result in results["results"]:
+
+        key = (result["stage"], result["inputs"], result["versions"])
+        if key not in previous:  # Not measured in the baseline
+            continue
+
+        before, after = previous[key], result["seconds"]
+        ratio = after / before if before else float("inf")
+        slower = ratio > 1 + threshold and after - before > NOISE_FLOOR
+
+        if slower:
+            regressions.append({**result, "baseline": before, "ratio": ratio})
+
+        stage, inputs, versions = key
+        print(f"{stage:>16} {inputs:>3} inputs {versions or '-':>6} versions {before:10.4f}s -> {after:10.4f}s "
+              f"({ratio:5.2f}x){'  REGRESSION' if slower else ''}")
+
+    return regressions
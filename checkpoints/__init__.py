@@ -0,0 +1,159 @@
+# Checkpoints for resuming runs
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+import re
+import time
+import numpy as np
+from image import SCHEMATIC_FOLDER, schematic_path
+from karnaugh import KMAP_FOLDER, kmap_path
+from settings import OUTPUT_FOLDER
+from writer import TEMPORARY_PATTERN, replacing
+
+# Constants
+CHECKPOINT_INTERVAL = 30  # Seconds between checkpoints
+HASH_BYTES = 16  # Size of the truth table hashes kept for functionally unique runs
+
+
+def checkpoint_path(filename: str) -> str:
+
+    """Returns the path of the checkpoint for a batch."""
+
+    return f"{OUTPUT_FOLDER}/{filename}.checkpoint.npz"
+
+
+class Checkpoint:
+
+    """
+    Everything needed to pick a run back up: the key of the gate order permutation, the position in the permutation
+    each version was drawn from, and the truth table hashes of the versions accepted so far by a functional filter.
+    Since the permutation never repeats and is the same for the same key, any version can be drawn again exactly from
+    these, so no set of the gate orders already used is needed. Saved to disk every CHECKPOINT_INTERVAL seconds. A
+    shard of a job starts at its first index rather than 0, and holds the number of versions in the whole job.
+    """
+
+    def __init__(self, path: str, key: bytes, layout: str, unique: bool, positions=None, seen=None, first=0,
+                 total=None):
+
+        self.path = path
+        self.key = key
+        self.layout = layout  # Version of the layout the positions were drawn for
+        self.unique = unique
+        self.first = first  # Index of the first version
+        self.total = total  # Versions in the whole job, if known
+        self.positions = positions if positions is not None else []  # Position of each version, from the first index
+        self.seen = seen if seen is not None else {}  # Truth table hashes of accepted versions, in index order
+        self.start = self.positions[-1] + 1 if self.positions else first  # Next position to draw from
+        self.saved = time.monotonic()
+
+    def record(self, position: int):
+
+        """Records the position the next version was drawn from, and saves the checkpoint if one is due."""
+
+        self.positions.append(position)
+        self.start = position + 1
+
+        if time.monotonic() - self.saved >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def rewind(self, index: int):
+
+        """Forgets every version from the index on, so drawing carries on as if they were never drawn."""
+
+        index -= self.first
+
+        if index < len(self.positions):
+            self.start = self.positions[index]
+
+        del self.positions[index:]
+        self.seen = dict.fromkeys(list(self.seen)[:index] if self.unique else [])
+
+    def save(self):
+
+        """Saves the checkpoint, through a temporary file so a checkpoint on disk is never partly written."""
+
+        with replacing(self.path) as temporary, open(temporary, "wb") as file:
+            np.savez(
+                file,
+                key=np.frombuffer(self.key, dtype=np.uint8),
+                layout=np.array(self.layout),
+                unique=np.array(self.unique),
+                first=np.array(self.first),
+                positions=np.array(self.positions, dtype=np.int64),
+                seen=np.frombuffer(b"".join(self.seen), dtype=np.uint8).reshape(-1, HASH_BYTES),
+                **({"total": np.array(self.total)} if self.total is not None else {})
+            )
+
+        self.saved = time.monotonic()
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+
+    """Loads a saved checkpoint."""
+
+    with np.load(path) as checkpoint:
+        return Checkpoint(
+            path,
+            checkpoint["key"].tobytes(),
+            str(checkpoint["layout"]),
+            bool(checkpoint["unique"]),
+            checkpoint["positions"].tolist(),
+            dict.fromkeys(_.tobytes() for _ in checkpoint["seen"]),
+            int(checkpoint["first"]) if "first" in checkpoint.files else 0,  # Checkpoints from before shards
+            int(checkpoint["total"]) if "total" in checkpoint.files else None
+        )
+
+
+def first_incomplete(filename: str, limit: int, kmaps=True, images=True, first=0) -> int:
+
+    """
+    Returns the index of the first version, from the first index and below the limit, that is missing any of its files.
+    Files are only ever renamed into place once they are complete, so a file that exists is whole.
+    """
+
+    index = first
+
+    while index < limit and version_complete(filename, index, kmaps, images):
+        index += 1
+
+    return index
+
+
+def version_complete(filename: str, index: int, kmaps=True, images=True) -> bool:
+
+    """Returns whether every file of a version has been written."""
+
+    return (not kmaps or os.path.isfile(kmap_path(filename, index))) and \
+        (not images or os.path.isfile(schematic_path(filename, index)))
+
+
+def remove_temporary(filename: str, name: str, limit: int, first=0) -> int:
+
+    """
+    Removes the temporary files left behind by a stopped run: those of its checkpoint, saved under the name, and those
+    of its versions, from the first index and below the limit. Temporary files of other batches sharing the output
+    folder are left alone, since they may still be being written. Returns the number of files removed.
+    """
+
+    checkpoint = os.path.basename(checkpoint_path(name))
+    version = re.compile(re.escape(filename) + r" #(\d+)\.(txt|png)")  # Follows the file name of a version
+    removed = 0
+
+    for folder in (OUTPUT_FOLDER, KMAP_FOLDER, SCHEMATIC_FOLDER):
+
+        if not os.path.isdir(folder):
+            continue
+
+        for file in os.listdir(folder):
+
+            match = re.fullmatch(TEMPORARY_PATTERN, file)
+            if match is None:  # Not a temporary file
+                continue
+
+            number = version.fullmatch(match[1])
+            if match[1] == checkpoint or (number is not None and first < int(number[1]) <= limit):
+                os.remove(f"{folder}/{file}")
+                removed += 1
+
+    return removed
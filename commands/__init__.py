@@ -4,7 +4,7 @@ __author__ = "Matteo Golin"
 # Imports
 import argparse as ap
 import os
-from image import INPUT_IMAGES, OUTPUT_FOLDER
+from settings import INPUT_LETTERS, KMAP_WINDOW, ORDERS, OUTPUT_FOLDER, RENDERERS
 
 # Parser
 DESC = "Creates a set of logic gate tree schematics of a size defined by the user using pre-made sprites. Sets contain no" \
@@ -30,6 +30,35 @@ def int_above_0(arg):
     return value  # Integer above 0
 
 
+def int_above_1(arg):
+
+    """Type function for argparse that ensures an integer above 1."""
+
+    value = int_above_0(arg)  # Ensure integer above 0
+
+    # Ensure above 1
+    if not value > 1:
+        raise ap.ArgumentTypeError(f"Integer must be greater than 1. (GOT: {arg})")
+
+    return value  # Integer above 1
+
+
+def shard(arg):
+
+    """Type function for argparse that reads a shard as k/N, the kth of N shards, and returns (k, N)."""
+
+    try:
+        number, shards = (int(_) for _ in arg.split("/"))
+    except ValueError:
+        raise ap.ArgumentTypeError(f"Must be two integers as k/N. (GOT: {arg})")
+
+    # Ensure the shard is one of the shards
+    if not 0 < number <= shards:
+        raise ap.ArgumentTypeError(f"Shard must be from 1 to the number of shards. (GOT: {arg})")
+
+    return number, shards  # Shard and number of shards
+
+
 # Get filename
 parser.add_argument(
     "-fname",
@@ -39,23 +68,35 @@ parser.add_argument(
     type=str
 )
 
-# Number of versions
-parser.add_argument(
+# Number of versions, or every version
+version_count = parser.add_mutually_exclusive_group(required=True)
+version_count.add_argument(
     "-v",
     help="Specifies the number of random versions to be made using the schematic layout.",
     type=int_above_0,  # Must be an integer above 0
-    metavar="versions",
-    required=True
+    metavar="versions"
+)
+version_count.add_argument(
+    "-all", "--all",
+    help="Makes every possible version of the schematic layout, in the same order every time, instead of a random set.",
+    action="store_true"
 )
 
 # Number of inputs
 parser.add_argument(
     "-i",
-    help="Specifies the number of inputs to be used in the schematic image.",
-    type=int,
+    help="Specifies the number of inputs to be used in the schematic image. More inputs than there are input sprites "
+         "need -poster.",
+    type=int_above_1,  # Min 2 inputs
     metavar="inputs",
-    choices=range(2, len(INPUT_IMAGES)),  # Min 2 inputs and max the number of unique inputs
-    default=len(INPUT_IMAGES),  # Default uses the maximum number of unique inputs
+    default=INPUT_LETTERS,  # Default uses the maximum number of single letter inputs
+)
+
+# Poster mode
+parser.add_argument(
+    "-poster",
+    help="Only lays out and renders the schematics, skipping Karnaugh maps, so layouts can have thousands of inputs.",
+    action="store_true"
 )
 
 # Clear output folder
@@ -65,6 +106,110 @@ parser.add_argument(
     action="store_true"
 )
 
+# Resume
+parser.add_argument(
+    "-resume", "--resume",
+    help="Carries on from the checkpoint of an earlier run with the same file name, skipping versions already saved.",
+    action="store_true"
+)
+
+# Seed
+parser.add_argument(
+    "-seed", "--seed",
+    metavar="seed",
+    help="Seeds which versions are drawn, so runs with the same seed and options make the same versions anywhere.",
+    type=int
+)
+
+# Shard
+parser.add_argument(
+    "-shard", "--shard",
+    metavar="k/N",
+    help="Only makes the kth of N equal slices of the versions, numbered as in the whole job. Every shard of a job "
+         "needs the same -seed, and merge.py puts the shards together once they are done.",
+    type=shard
+)
+
+# Version order
+parser.add_argument(
+    "-order",
+    help="The order versions are drawn in: shuffled at random, walking a Gray code so each version changes one gate "
+         "from the last, which evaluates large schematics much faster, or counting up through the gate orders. Random "
+         "by default, or sequential with -all.",
+    choices=ORDERS
+)
+
+# Functionally unique versions
+parser.add_argument(
+    "-unique",
+    help="Only keeps versions whose Karnaugh maps differ from every other version, not just their gates.",
+    action="store_true"
+)
+
+# Streaming window
+parser.add_argument(
+    "-window",
+    metavar="window",
+    help="The largest number of versions held in memory at once while generating.",
+    type=int_above_0,  # Must be an integer above 0
+    default=KMAP_WINDOW
+)
+
+# Image workers
+parser.add_argument(
+    "-j", "--workers",
+    metavar="workers",
+    help="The number of processes used to render images.",
+    type=int_above_0,  # Must be an integer above 0
+    default=1  # Default renders in the main process
+)
+
+# File writers
+parser.add_argument(
+    "-writers",
+    metavar="writers",
+    help="The number of background threads writing images and Karnaugh maps to disk.",
+    type=int_above_0,  # Must be an integer above 0
+    default=1  # Default writes on one thread alongside generation
+)
+
+# Archive output
+parser.add_argument(
+    "-archive",
+    help="Saves the whole batch to a single .npz archive in the output folder instead of a pair of files per version.",
+    action="store_true"
+)
+
+# Skip images
+parser.add_argument(
+    "-noimages",
+    help="Doesn't make images. Archived versions can still be rendered later with extract.py.",
+    action="store_true"
+)
+
+# Image renderer
+parser.add_argument(
+    "-renderer",
+    help="How images are assembled: pasting sprites with Pillow, or indexing a NumPy tile atlas.",
+    choices=RENDERERS,
+    default="paste"
+)
+
+# Metrics file
+parser.add_argument(
+    "-metrics",
+    metavar="metrics file",
+    help="Writes the time taken by each stage, counters and throttled progress to a file as JSON lines.",
+    type=str
+)
+
+# Quiet mode
+parser.add_argument(
+    "-quiet",
+    help="Doesn't show progress bars or status messages.",
+    action="store_true"
+)
+
 # Scale factor
 parser.add_argument(
     "-s",
@@ -75,6 +220,162 @@ parser.add_argument(
 )
 
 
+# Archive extraction
+extract_parser = ap.ArgumentParser(description="Extracts versions from a batch archive into the output folder.")
+
+extract_parser.add_argument(
+    "archive",
+    help="The path of the archive.",
+    type=str
+)
+
+extract_parser.add_argument(
+    "-n",
+    metavar="numbers",
+    help="The version numbers to extract.",
+    type=int_above_0,  # Must be an integer above 0
+    nargs="+",
+    required=True
+)
+
+extract_parser.add_argument(
+    "-renderer",
+    help="How images are assembled, if the archive doesn't hold them.",
+    choices=RENDERERS,
+    default="paste"
+)
+
+extract_parser.add_argument(
+    "-s",
+    metavar="scalar",
+    help="The factor by which images are scaled up, if the archive doesn't hold them.",
+    type=int_above_0,  # Must be an integer above 0
+    default=1
+)
+
+
+# Shard merging
+merge_parser = ap.ArgumentParser(description="Checks the shards of a job and puts them together into one archive.")
+
+merge_parser.add_argument(
+    "-fname",
+    metavar="file name",
+    required=True,
+    help="The filename the shards were saved under.",
+    type=str
+)
+
+
+# Generator service
+serve_parser = ap.ArgumentParser(description="Serves batches over HTTP on this machine, keeping layouts loaded.")
+
+serve_parser.add_argument(
+    "-port",
+    metavar="port",
+    help="The local port batches are served on.",
+    type=int_above_0,  # Must be an integer above 0
+    default=8000
+)
+
+serve_parser.add_argument(
+    "-cache",
+    metavar="size",
+    help="The number of input counts whose layouts are kept loaded at once.",
+    type=int_above_0,  # Must be an integer above 0
+    default=8
+)
+
+serve_parser.add_argument(
+    "-warm",
+    metavar="inputs",
+    help="Input counts whose layouts are loaded before the first request.",
+    type=int_above_1,  # Min 2 inputs
+    nargs="+",
+    default=[]
+)
+
+serve_parser.add_argument(
+    "-metrics",
+    metavar="metrics file",
+    help="Writes every request and the counters to a file as JSON lines.",
+    type=str
+)
+
+serve_parser.add_argument(
+    "-quiet",
+    help="Doesn't show status messages or log requests.",
+    action="store_true"
+)
+
+
+# Benchmarks
+benchmark_parser = ap.ArgumentParser(description="Times every stage of the pipeline across input and version counts.")
+
+benchmark_parser.add_argument(
+    "-i",
+    metavar="inputs",
+    help="The input counts to time.",
+    type=int_above_1,  # Min 2 inputs
+    nargs="+",
+    default=[2, 6, 10, 14, 18, 22]
+)
+
+benchmark_parser.add_argument(
+    "-v",
+    metavar="versions",
+    help="The version counts to time.",
+    type=int_above_0,  # Must be an integer above 0
+    nargs="+",
+    default=[1, 10, 100]
+)
+
+benchmark_parser.add_argument(
+    "-seed", "--seed",
+    metavar="seed",
+    help="Seeds which versions are drawn, so runs time the same work.",
+    type=int,
+    default=0
+)
+
+benchmark_parser.add_argument(
+    "-order",
+    help="The order versions are drawn in.",
+    choices=ORDERS,
+    default="random"
+)
+
+benchmark_parser.add_argument(
+    "-repeats",
+    metavar="repeats",
+    help="How many times each stage is timed. The fastest time is kept.",
+    type=int_above_0,  # Must be an integer above 0
+    default=3
+)
+
+benchmark_parser.add_argument(
+    "-o",
+    metavar="output",
+    help="The JSON file the results are saved to.",
+    type=str,
+    default="benchmark.json"
+)
+
+benchmark_parser.add_argument(
+    "-compare",
+    metavar="baseline",
+    help="A JSON file of earlier results to compare against. Exits with status 1 if any stage regressed.",
+    type=str
+)
+
+benchmark_parser.add_argument(
+    "-threshold",
+    metavar="threshold",
+    help="The fraction a stage must slow down by to count as a regression.",
+    type=float,
+    default=0.25
+)
+
+
 # Function to clear output folder
 def clear_output(output_folder=OUTPUT_FOLDER):
 
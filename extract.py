@@ -0,0 +1,34 @@
+# Extracts versions from a batch archive
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+from commands import extract_parser
+from settings import INPUT_LETTERS
+
+# Program parameters
+arguments = extract_parser.parse_args()
+
+# The pipeline is only imported once the arguments are read, so -h doesn't wait for it
+from archive import ArchiveReader
+from image import schematic_path
+from karnaugh import kmap_path
+
+archive = ArchiveReader(arguments.archive)
+filename = os.path.splitext(os.path.basename(arguments.archive))[0]  # Files are named after the archive
+
+for number in arguments.n:
+
+    if number not in archive:
+        print(f"Version #{number} isn't in the archive.")
+        continue
+
+    with open(schematic_path(filename, number - 1), "wb") as file:
+        file.write(archive.image(number, arguments.s, arguments.renderer))
+
+    # Karnaugh maps are only made for schematics with single letter inputs
+    if archive.netlist.inputs <= INPUT_LETTERS:
+        with open(kmap_path(filename, number - 1), "w") as file:
+            file.write(archive.worksheet(number))
+
+    print(f"Extracted version #{number}.")
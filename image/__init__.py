@@ -2,82 +2,87 @@
 __author__ = "Matteo Golin"
 
 # Imports
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import functools
+import io
 from PIL import Image
 import numpy as np
-import os
-from progress.bar import IncrementalBar
+from metrics import Progress
+from settings import ASSET_FOLDER, MANIFEST, OUTPUT_FOLDER
+from symbols import EMPTY, INPUT, WIRES, GATE_GENER, GATES
+from writer import Writer
 
 # Constants
 
 # Folders
-ASSET_FOLDER = "assets"
-OUTPUT_FOLDER = "output"
 SCHEMATIC_FOLDER = f"{OUTPUT_FOLDER}/schematics"
 GATES_FOLDER = f"{ASSET_FOLDER}/gates"
 INPUTS_FOLDER = f"{ASSET_FOLDER}/inputs"
 NUMBERING_FOLDER = f"{ASSET_FOLDER}/numbering"
 WIRES_FOLDER = f"{ASSET_FOLDER}/wires"
 
-# Symbols for schematics
-GATE_GENER = "□"  # Generic gate symbol
-WIRES = {
-    "fork": u'\u2524',
-    "merge": "2",  # Changing this breaks the program somehow
-    "run": "|",
-    "dual up": "4",
-    "dual down": "5",
-    "dual bend up": "6",
-    "dual bend down": "7",
-    "curve up": u'\u2518',
-    "curve down": u'\u2510'
-}
-GATES = {
-    "&": "and",
-    "*": "nand",
-    ")": "or",
-    "(": "nor",
-    "%": "xnor",
-    "^": "xor"
-}
-
 GRID_SIZE = (17, 17)  # Width, height
 NUM_SIZE = (5, 5)  # Width, height
+ATLAS_CACHE_SIZE = 4  # Scalars with a tile atlas kept in memory at once
 
 # Colours
 TRANSPARENT = (255, 0, 0, 0)
 BG = (150, 162, 179, 255)
 
-# Images
-GATE_IMAGES = {
-    "and": Image.open(f"{GATES_FOLDER}/and.png"),
-    "or": Image.open(f"{GATES_FOLDER}/or.png"),
-    "nand": Image.open(f"{GATES_FOLDER}/nand.png"),
-    "nor": Image.open(f"{GATES_FOLDER}/nor.png"),
-    "xor": Image.open(f"{GATES_FOLDER}/xor.png"),
-    "xnor": Image.open(f"{GATES_FOLDER}/xnor.png")
-}
-WIRE_IMAGES = {
-    WIRES["fork"]: Image.open(f"{WIRES_FOLDER}/fork.png"),
-    WIRES["merge"]: Image.open(f"{WIRES_FOLDER}/merge.png"),
-    WIRES["run"]: Image.open(f"{WIRES_FOLDER}/run.png"),
-    WIRES["dual up"]: Image.open(f"{WIRES_FOLDER}/dualUp.png"),
-    WIRES["dual down"]: Image.open(f"{WIRES_FOLDER}/dualDown.png"),
-    WIRES["dual bend up"]: Image.open(f"{WIRES_FOLDER}/dualBendUp.png"),
-    WIRES["dual bend down"]: Image.open(f"{WIRES_FOLDER}/dualBendDown.png"),
-    WIRES["curve up"]: Image.open(f"{WIRES_FOLDER}/curveUp.png"),
-    WIRES["curve down"]: Image.open(f"{WIRES_FOLDER}/curveDown.png")
-}
 
-INPUT_IMAGES = {}
-for filename in os.listdir(INPUTS_FOLDER):
-    INPUT_IMAGES[filename.replace(".png", "")] = Image.open(f"{INPUTS_FOLDER}/{filename}")
+class Sprites(Mapping):
+
+    """
+    Read-only dictionary of the sprites in an asset folder. Each sprite is opened and decoded the first time it is
+    used, while its key is known from the manifest up front.
+    """
+
+    def __init__(self, folder: str, files: dict[str, str]):
+        self.folder = folder
+        self.files = files  # Key to file name
+        self.images = {}  # Key to loaded image
+
+    def __getitem__(self, key) -> Image.Image:
+
+        if key not in self.images:
+            image = Image.open(f"{self.folder}/{self.files[key]}")
+            image.load()  # Decode now rather than on every paste
+            self.images[key] = image
+
+        return self.images[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.files  # Doesn't open the image
+
+    def __iter__(self):
+        return iter(self.files)
 
-NUMBER_IMAGES = {}
-for filename in os.listdir(NUMBERING_FOLDER):
-    NUMBER_IMAGES[filename.replace(".png", "")] = Image.open(f"{NUMBERING_FOLDER}/{filename}")
+    def __len__(self) -> int:
+        return len(self.files)
+
+
+# Images
+GATE_IMAGES = Sprites(GATES_FOLDER, MANIFEST["gates"])
+WIRE_IMAGES = Sprites(WIRES_FOLDER, {WIRES[wire]: file for wire, file in MANIFEST["wires"].items()})
+INPUT_IMAGES = Sprites(INPUTS_FOLDER, MANIFEST["inputs"])
+NUMBER_IMAGES = Sprites(NUMBERING_FOLDER, MANIFEST["numbering"])
+INPUT_NAMES = list(INPUT_IMAGES)  # Input k is named INPUT_NAMES[k], with longer labels past the last name
+
+STATIC_LAYERS = {}  # Rendered static layers, by layout
 
 
 # Basic image functions
+def load_assets():
+
+    """Loads every sprite up front, so worker processes decode each file once rather than once per task."""
+
+    for images in (GATE_IMAGES, WIRE_IMAGES, INPUT_IMAGES, NUMBER_IMAGES):
+        for _ in images.values():  # Loaded on access
+            pass
+
+
 def rescale(img: Image.Image, scale_factor: int) -> Image.Image:
 
     """Rescales the image by a given factor using the nearest neighbour method. Returns the scaled image."""
@@ -112,50 +117,45 @@ def number_tag(num: int) -> Image.Image:
     return base
 
 
-# Create image from grid
-def image_from_grid(grid: np.ndarray) -> Image.Image:
+def input_label(index: int) -> list[str]:
 
-    """Creates an image from the grid passed and saves it with with the specified filename."""
+    """
+    Returns the sprite names spelling an input's label, where input 0 is the first input. Labels count through the
+    input names like spreadsheet columns (a to z, then aa, ab and so on), so every input keeps a distinct label.
+    """
 
-    # Dimensions
-    grid = np.rot90(grid)
-    n, width = grid.shape
-    new_width, new_height = width * GRID_SIZE[0], n * GRID_SIZE[1]
+    label = []
+    index += 1
 
-    # Create the base image
-    base = Image.new('RGBA', (new_width, new_height), TRANSPARENT)
+    while index > 0:
+        index, digit = divmod(index - 1, len(INPUT_NAMES))
+        label.insert(0, INPUT_NAMES[digit])
 
-    # Iterate through grid
-    for row in range(n):
-        for column in range(width):
+    return label
 
-            do_nothing = False  # Assume we will find a gate or wire
 
-            # Found gate
-            if grid[row][column] in GATES:
-                cell = GATE_IMAGES[GATES[grid[row][column]]]  # Get gate image
+def input_name(index: int) -> str:
 
-            # Found wire
-            elif grid[row][column] in WIRES.values():
-                cell = WIRE_IMAGES[grid[row][column]]  # Get the corresponding wire image
+    """Returns the name of an input, where input 0 is the first input."""
 
-            # Empty
-            elif grid[row][column] == " ":
-                do_nothing = True  # Do nothing
+    return "".join(input_label(index))
 
-            # Input
-            else:
-                cell = INPUT_IMAGES[grid[row][column]].transpose(Image.ROTATE_270)  # Rotate too
 
-            if not do_nothing:  # We found a gate or wire
+@functools.cache
+def label_tiles(inputs: int) -> np.ndarray:
 
-                # Traverse x and y by a factor of GRID_SIZE
-                x = column * GRID_SIZE[1]
-                y = row * GRID_SIZE[0]
+    """
+    Returns the input sprite of every label character as a (label rows x inputs) array of indices into INPUT_NAMES.
+    Labels are written downwards from the input cell, and cells below a shorter label are -1.
+    """
 
-                base.paste(cell, (x, y))  # Paste the cell where it belongs
+    labels = [input_label(_) for _ in range(inputs)]
+    tiles = np.full((len(labels[-1]), inputs), -1, dtype=np.intp)  # The last input has the longest label
 
-    return base
+    for column, label in enumerate(labels):
+        tiles[:len(label), column] = [INPUT_NAMES.index(name) for name in label]
+
+    return tiles
 
 
 def add_background(schematic: Image.Image) -> Image.Image:
@@ -171,33 +171,240 @@ def add_background(schematic: Image.Image) -> Image.Image:
     return composite
 
 
-def create_image_batch(unique_grids: dict[int, np.ndarray], filename: str, scalar=1):
+def cell_position(grid: np.ndarray, row: int, column: int) -> tuple[int, int]:
+
+    """Returns the top left pixel of a grid cell in the final (rotated) schematic image."""
+
+    height, width = grid.shape
+
+    return (width - 1 - column) * GRID_SIZE[0], (height - 1 - row) * GRID_SIZE[1]
+
+
+@functools.cache
+def gate_tile(gate: str) -> Image.Image:
+
+    """Returns the sprite of a gate rotated into the final orientation, on top of the background."""
+
+    return add_background(GATE_IMAGES[gate].transpose(Image.ROTATE_90))
+
+
+def layer_key(grid: np.ndarray) -> tuple:
+
+    """Returns the key of a schematic's static layer in STATIC_LAYERS, the same for every version of a layout."""
+
+    layout = np.where(np.isin(grid, list(GATES)), GATE_GENER, grid)  # Forget which gates were placed
+
+    return layout.shape, layout.tobytes()
+
+
+def static_layer(grid: np.ndarray) -> Image.Image:
+
+    """
+    Returns the background, wires and inputs of a schematic in its final orientation. Gates are left out, so every
+    version of a base grid shares the same layer, which is only rendered once.
+    """
+
+    key = layer_key(grid)
+
+    if key not in STATIC_LAYERS:
+
+        height, width = grid.shape
+        labels = label_tiles(width)  # Extra label characters hang below the image
+        base = Image.new("RGBA", (width * GRID_SIZE[0], (height + len(labels) - 1) * GRID_SIZE[1]), TRANSPARENT)
+
+        for row in range(height):
+            for column in range(width):
+
+                symbol = grid[row][column]  # Gates are neither wires nor inputs, so are left out
+
+                if symbol in WIRES.values():  # Wires are rotated with the rest of the schematic
+                    base.paste(WIRE_IMAGES[symbol].transpose(Image.ROTATE_90), cell_position(grid, row, column))
+
+                elif symbol == INPUT:  # Input letters stay upright, spelled downwards from the input cell
+
+                    x, y = cell_position(grid, row, column)
+                    for line, name in enumerate(input_label(width - 1 - column)):
+                        base.paste(INPUT_IMAGES[name], (x, y + line * GRID_SIZE[1]))
+
+        STATIC_LAYERS[key] = add_background(base)
+
+    return STATIC_LAYERS[key]
+
+
+def render_paste(grid: np.ndarray, index: int, scalar=1) -> Image.Image:
+
+    """Renders a single schematic with its number tag by pasting its gates onto the cached static layer."""
+
+    # Image making
+    final = static_layer(grid).copy()  # Background, wires and inputs
+
+    # Only the gates differ between versions
+    for row, column in zip(*np.nonzero(np.isin(grid, list(GATES)))):
+        final.paste(gate_tile(GATES[grid[row][column]]), cell_position(grid, row, column))
+
+    tag = add_background(number_tag(index + 1))  # Create tag image
+    final.paste(tag, (1, 1))  # Add tag to image
+
+    # Optional rescaling
+    if scalar != 1:  # If a scale factor is passed
+        final = rescale(final, scalar)  # Rescale
+
+    return final
+
+
+@functools.lru_cache(maxsize=ATLAS_CACHE_SIZE)
+def tile_atlas(scalar=1) -> tuple[np.ndarray, np.ndarray]:
 
     """
-    Creates a batch of images from the given grid layout, and returns the gate combinations for each schematic image.
+    Returns every sprite in its final orientation and on top of the background as a single (tiles x height x width x 4)
+    array already scaled by the scalar, along with the tile index of each grid symbol. Empty cells use tile 0, and the
+    input sprites are the last tiles, in the order of INPUT_NAMES.
     """
 
-    versions = len(unique_grids)  # Number of version
-    bar = IncrementalBar("Images", max=versions)  # Progress bar
+    empty = Image.new("RGBA", GRID_SIZE, TRANSPARENT)
+    sprites = {EMPTY: empty, GATE_GENER: empty}
+
+    for symbol, gate in GATES.items():
+        sprites[symbol] = GATE_IMAGES[gate].transpose(Image.ROTATE_90)  # Rotated with the rest of the schematic
+
+    for symbol, wire in WIRE_IMAGES.items():
+        sprites[symbol] = wire.transpose(Image.ROTATE_90)
+
+    tile_index = np.zeros(256, dtype=np.intp)
+    tile_index[list(sprites)] = np.arange(len(sprites))
+    tile_index[INPUT] = len(sprites)  # First input sprite
+
+    # Stack the tiles, scaling each pixel up to a scalar x scalar block
+    tiles = list(sprites.values()) + [INPUT_IMAGES[name] for name in INPUT_NAMES]  # Input letters stay upright
+    atlas = np.stack([np.asarray(add_background(sprite)) for sprite in tiles])
+    atlas = atlas.repeat(scalar, axis=1).repeat(scalar, axis=2)
+
+    return atlas, tile_index
 
-    for _ in range(versions):
 
-        # Progress display
-        bar.next()
+def render_atlas(grid: np.ndarray, index: int, scalar=1) -> Image.Image:
+
+    """
+    Renders a single schematic with its number tag by looking up every cell in the tile atlas at once and assembling the
+    pixels with NumPy. Produces the same image as render_paste.
+    """
+
+    atlas, tile_index = tile_atlas(scalar)
+    tile_size = atlas.shape[1]
+
+    # The final image is the grid turned 180 degrees, so flip it and map every cell to its tile
+    flipped = grid[::-1, ::-1]
+    height, width = grid.shape
+
+    # Extra label characters hang below the image, on empty tiles
+    labels = label_tiles(width)
+    tiles = np.zeros((height + len(labels) - 1, width), dtype=np.intp)
+    tiles[:height] = tile_index[flipped]
+
+    # Flipping puts input k in column k, so its label is column k of the label tiles
+    inputs = np.flatnonzero(flipped[-1] == INPUT)
+    for line, characters in enumerate(labels):
+        spelled = inputs[characters[inputs] >= 0]
+        tiles[height - 1 + line, spelled] = tile_index[INPUT] + characters[spelled]
+
+    # (rows x columns x tile height x tile width x 4) into (height x width x 4)
+    height = len(tiles)
+    pixels = atlas[tiles].transpose(0, 2, 1, 3, 4).reshape(height * tile_size, width * tile_size, 4)
+
+    # Number tag, cut off at the edge of the image like a paste would
+    tag = np.asarray(add_background(number_tag(index + 1))).repeat(scalar, axis=0).repeat(scalar, axis=1)
+    tag = tag[:pixels.shape[0] - scalar, :pixels.shape[1] - scalar]
+    pixels[scalar:scalar + tag.shape[0], scalar:scalar + tag.shape[1]] = tag
+
+    return Image.fromarray(pixels, "RGBA")
+
+
+RENDER_FUNCTIONS = {  # Each of RENDERERS, by name
+    "paste": render_paste,
+    "atlas": render_atlas
+}
+
 
-        # Image making
-        schematic = image_from_grid(unique_grids[_])  # Get transparent schematic and its gate list
+def schematic_path(filename: str, index: int) -> str:
 
-        schematic = schematic.transpose(Image.ROTATE_90)  # Rotate 90 deg
-        tag = number_tag(_ + 1)  # Create tag image
-        schematic.paste(tag, (1, 1))  # Add tag to image
+    """Returns the path of a schematic image file."""
 
-        final = add_background(schematic)  # Add a background
+    return f"{SCHEMATIC_FOLDER}/{filename} #{index + 1}.png"
 
-        # Optional rescaling
-        if scalar != 1:  # If a scale factor is passed
-            final = rescale(final, scalar)  # Rescale
 
-        final.save(f"{SCHEMATIC_FOLDER}/{filename} #{_ + 1}.png")  # Save to output folder
+def encode_schematic(grid: np.ndarray, index: int, scalar=1, renderer="paste") -> bytes:
+
+    """Renders a single schematic with its number tag and returns it encoded as a PNG file."""
+
+    final = RENDER_FUNCTIONS[renderer](grid, index, scalar)
+    encoded = io.BytesIO()
+    final.save(encoded, "PNG")
+
+    return encoded.getvalue()
+
+
+def save_schematic(grid: np.ndarray, filename: str, index: int, scalar=1, renderer="paste"):
+
+    """Renders a single schematic with its number tag and saves it to the output folder."""
+
+    with open(schematic_path(filename, index), "wb") as file:  # Save to output folder
+        file.write(encode_schematic(grid, index, scalar, renderer))
+
+
+def create_image_batch(grids, filename: str, scalar=1, versions=None, workers=1, renderer="paste", writers=1,
+                       archive=None):
+
+    """
+    Creates a batch of images from (index, grid) pairs, such as the items of a dictionary of grids. The pairs are
+    consumed one at a time, so they can come from a stream. Versions is only used to size the progress bar. With more
+    than one worker, images are rendered and encoded in a pool of processes. Encoded images are written by a number of
+    background writer threads, so rendering doesn't wait on the disk, or added to an archive writer if one is passed.
+    Returns the number of images made.
+    """
+
+    if versions is None:
+        versions = len(grids)  # Number of versions
+    bar = Progress("Images", versions)  # Progress bar
+
+    with Writer(writers) as writer:
+
+        def save(index: int, image: bytes):
+            if archive is not None:
+                archive.add_image(image)
+            else:
+                writer.write(schematic_path(filename, index), image)
+
+        if workers == 1:
+
+            for index, grid in grids:
+
+                # Progress display
+                bar.next()
+
+                save(index, encode_schematic(grid, index, scalar, renderer))
+
+        else:
+
+            pending = collections.deque()  # Submitted images and their indices, oldest first
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=load_assets) as pool:
+
+                for index, grid in grids:
+
+                    # Wait for the oldest image once enough are queued, so the stream isn't drained into memory
+                    if len(pending) == workers * 4:
+                        done, image = pending.popleft()
+                        save(done, image.result())
+                        bar.next()
+
+                    # The index travels with the task, so file numbering doesn't depend on which worker finishes first
+                    pending.append((index, pool.submit(encode_schematic, grid, index, scalar, renderer)))
+
+                while pending:
+                    done, image = pending.popleft()
+                    save(done, image.result())
+                    bar.next()
 
     bar.finish()
+
+    return bar.done  # Number of images
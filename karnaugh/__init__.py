@@ -2,10 +2,18 @@
 __author__ = "Matteo Golin"
 
 # Imports
+import functools
+import hashlib
+import itertools
 import numpy as np
 import operator
-from progress.bar import IncrementalBar
-from image import WIRES, GATES, OUTPUT_FOLDER, INPUT_IMAGES
+import tempfile
+from typing import NamedTuple
+from metrics import Progress, count
+from image import input_name
+from settings import KMAP_WINDOW, OUTPUT_FOLDER
+from symbols import WIRES, GATES
+from writer import Writer
 
 
 # Custom boolean functions
@@ -21,6 +29,16 @@ def xnor(a: bool, b: bool) -> bool:
     return not (a ^ b)
 
 
+def gate_coefficients(name: str) -> list[bool]:
+
+    """Returns the algebraic normal form of a gate as the coefficients of: c0 ^ (c1 & a) ^ (c2 & b) ^ (c3 & a & b)."""
+
+    operation = GATE_OPERATIONS[name]
+    f00, f01, f10, f11 = (operation(a, b) for a, b in ((False, False), (False, True), (True, False), (True, True)))
+
+    return [f00, f00 ^ f10, f00 ^ f01, f00 ^ f01 ^ f10 ^ f11]
+
+
 # CONSTANTS
 GATE_OPERATIONS = {
     "and": operator.and_,
@@ -32,6 +50,106 @@ GATE_OPERATIONS = {
 }
 KMAP_FOLDER = f"{OUTPUT_FOLDER}/kmaps"
 
+# Packed truth tables
+WORD_BITS = 64  # Input combinations per uint64 word
+ALL_ONES = np.uint64(2 ** WORD_BITS - 1)
+INPUT_PATTERNS = [  # Bit patterns of the first six inputs inside a single word
+    0xAAAAAAAAAAAAAAAA,
+    0xCCCCCCCCCCCCCCCC,
+    0xF0F0F0F0F0F0F0F0,
+    0xFF00FF00FF00FF00,
+    0xFFFF0000FFFF0000,
+    0xFFFFFFFF00000000
+]
+
+# Gate codes are positions in GATES, looked up from grid symbols, with one row of algebraic normal form coefficients
+# per gate
+GATE_CODES = np.zeros(256, dtype=np.uint8)
+GATE_CODES[list(GATES)] = np.arange(len(GATES))
+GATE_COEFFICIENTS = np.array(
+    [[ALL_ONES if coefficient else 0 for coefficient in gate_coefficients(name)] for name in GATES.values()],
+    dtype=np.uint64
+)
+GATE_UFUNCS = [  # Bitwise operation of each gate code, and whether its result is inverted
+    {"and": (np.bitwise_and, False), "nand": (np.bitwise_and, True), "or": (np.bitwise_or, False),
+     "nor": (np.bitwise_or, True), "xor": (np.bitwise_xor, False), "xnor": (np.bitwise_xor, True)}[name]
+    for name in GATES.values()
+]
+KMAP_BATCH_WORDS = 2 ** 20  # Words of each intermediate vector evaluated at once across a batch of versions
+INCREMENTAL_WORDS = 2 ** 10  # Truth tables at least this long are evaluated one version at a time, incrementally
+KMAP_CHUNK_CELLS = 2 ** 20  # Karnaugh map cells filled or read at once
+KMAP_MEMORY_CELLS = 2 ** 22  # Larger Karnaugh maps are kept in memory mapped files
+
+
+# Compiled schematic
+class Netlist(NamedTuple):
+
+    """
+    Topologically ordered gate list of a base schematic. Nodes 0 to inputs - 1 are the inputs, and node inputs + i is
+    the gate at gates[i]. children holds the two node indices feeding each gate.
+    """
+
+    inputs: int
+    gates: list[tuple[int, int]]
+    children: np.ndarray
+
+
+class KarnaughMap:
+
+    """
+    Bit-packed Karnaugh map, without its labels, which are generated when needed. Row r holds the cells of the r-th left
+    side Gray code, packed 8 columns to a byte. Maps larger than KMAP_MEMORY_CELLS are kept in a temporary memory mapped
+    file instead of in memory. Maps are filled and read in chunks of rows, so the whole map is never unpacked at once.
+    """
+
+    def __init__(self, inputs: int):
+
+        self.inputs = inputs
+        self.top, self.left = split_gates(inputs)  # Inputs on each side, with more on the left
+        self.shape = (2 ** self.left, 2 ** self.top)  # Cells
+        packed = (self.shape[0], -(-self.shape[1] // 8))  # Bytes
+
+        if self.shape[0] * self.shape[1] > KMAP_MEMORY_CELLS:
+            self.bits = np.memmap(tempfile.TemporaryFile(), dtype=np.uint8, mode="w+", shape=packed)  # Starts as 0s
+        else:
+            self.bits = np.zeros(packed, dtype=np.uint8)
+
+    def row_chunks(self):
+
+        """Yields (start, stop) ranges of rows that hold up to KMAP_CHUNK_CELLS cells each."""
+
+        step = max(1, KMAP_CHUNK_CELLS // self.shape[1])
+
+        for start in range(0, self.shape[0], step):
+            yield start, min(start + step, self.shape[0])
+
+    def rows(self, start: int, stop: int) -> np.ndarray:
+
+        """Returns the cells of a range of rows as 0s and 1s."""
+
+        return np.unpackbits(self.bits[start:stop], axis=1, count=self.shape[1], bitorder="little")
+
+    def fill(self, start: int, stop: int, cells: np.ndarray):
+
+        """Sets the cells of a range of rows from 0s and 1s."""
+
+        self.bits[start:stop] = np.packbits(cells, axis=1, bitorder="little")
+
+    def to_array(self) -> np.ndarray:
+
+        """Returns the whole map as an object array, with labels in the first row and column. Only for small maps."""
+
+        height, width = self.shape[0] + 1, self.shape[1] + 1  # Dimensions (additional row and column for labels)
+        kmap = np.full((height, width), "0", dtype=object)
+
+        # Filling labels
+        kmap[0][0] = "#"  # Unused corner
+        kmap[1:, 0] = generate_index(self.left)  # Fill left column with left labels
+        kmap[0, 1:] = generate_index(self.top)  # Fill top row with top labels
+        kmap[1:, 1:] = self.rows(0, self.shape[0])
+
+        return kmap
+
 
 # Mathematical functions
 
@@ -74,42 +192,47 @@ def split_gates(inputs: int) -> tuple[int, int]:
     return left, top
 
 
-def swap_bit(number: str, bit_to_swap: int) -> str:
+@functools.cache
+def gray_code(bits: int) -> np.ndarray:
 
-    """Swaps the bit at the given index and returns the new number as a string."""
+    """Returns the reflected Gray code of the given width as integers, in an order where each step changes one bit."""
 
-    number = list(number)
+    steps = np.arange(2 ** bits, dtype=np.int64)
+    codes = steps ^ (steps >> 1)
+    codes.flags.writeable = False  # Shared between calls
 
-    if number[bit_to_swap] == "0":
-        number[bit_to_swap] = "1"
-    else:
-        number[bit_to_swap] = "0"
+    return codes
 
-    return "".join(number)
 
-
-def generate_index(inputs: int) -> list[str]:
+def axis_labels(bits: int, start=0, stop=None) -> np.ndarray:
 
     """
-    Returns the index for the inputs along an axes of the Karnaugh map as a list of binary numbers represented as
-    strings.
+    Returns a range of the labels along an axes of the Karnaugh map as a (labels x bits) array of '0' and '1' character
+    codes. Bit k of each Gray code is written as character k, so the first input is on the left.
     """
 
-    steps = ["0" * inputs]  # Track steps
+    codes = gray_code(bits)[start:stop]
+
+    return ((codes[:, None] >> np.arange(bits)) & 1).astype(np.uint8) + ord("0")
+
+
+def generate_index(inputs: int) -> list[str]:
 
-    for step in steps:
+    """Returns the index for the inputs along an axes of the Karnaugh map as a list of binary numbers as strings."""
 
-        if len(steps) == 2 ** inputs:  # No more steps
-            return steps
+    return [label.tobytes().decode("ascii") for label in axis_labels(inputs)]
 
-        for _ in range(inputs):  # Go through each bit
 
-            next_step = swap_bit(step, _)  # Swap bit
+def kmap_index(inputs: int, start=0, stop=None) -> np.ndarray:
+
+    """
+    Returns the truth table index of every cell in a range of rows of a Karnaugh map (without labels). The left side
+    inputs are the low bits and the top side inputs are the high bits.
+    """
+
+    top, left = split_gates(inputs)  # Same split as KarnaughMap
 
-            # If the number with the swapped bit isn't already a step, then record it and continue
-            if next_step not in steps:
-                steps.append(next_step)
-                break
+    return gray_code(left)[start:stop, None] | (gray_code(top)[None, :] << left)
 
 
 def previous_gates(grid: np.ndarray, gate_coordinates: tuple[int, int]) -> tuple[tuple[int, int], tuple[int, int]]:
@@ -147,189 +270,378 @@ def previous_gates(grid: np.ndarray, gate_coordinates: tuple[int, int]) -> tuple
     return gate1, gate2
 
 
-def output_tree(grid: np.ndarray, gate_coordinates: tuple[int, int], input: str) -> dict:
+def compile_netlist(grid: np.ndarray, gate_coords: list[tuple[int, int]]) -> Netlist:
 
-    stack = [gate_coordinates]  # Create the stack of gates to be explored
-    tree = {}  # Empty dictionary to store the tree structure
-    input = list(reversed(input))  # Reverse the input so index 0 lines up with input a
+    """
+    Compiles a wired base schematic into a netlist. Input nodes come first (node k is the input at bit k of the input
+    string), followed by the gates in the order of gate_coords, which is already topological.
+    """
 
-    for gate in stack:  # Go through the stack
+    inputs = grid.shape[1]  # Number of inputs
 
-        previous_gate1, previous_gate2 = previous_gates(grid, gate)  # Get the two previous gates
+    # Map every coordinate that can feed a gate to its node index
+    nodes = {(0, column): inputs - 1 - column for column in range(inputs)}  # Input a is in the last column
+    for _, gate in enumerate(gate_coords):
+        nodes[gate] = inputs + _
 
-        if previous_gate1[0] == 0:  # Found a pair of inputs
+    # Each gate's two children as node indices
+    children = np.array(
+        [[nodes[previous] for previous in previous_gates(grid, gate)] for gate in gate_coords],
+        dtype=np.int32
+    )
 
-            # Set the input equal to its value set by the input
-            previous_gate1 = input[previous_gate1[1]]
-            previous_gate2 = input[previous_gate2[1]]
+    return Netlist(inputs, list(gate_coords), children)
 
-        else:  # We found a pair of gates
-            stack.extend([previous_gate1, previous_gate2])  # Add the gates to the stack to be explored
 
-        # Store the gates/inputs in the tree structure
-        tree[gate] = [previous_gate1, previous_gate2]
+def gate_operations(netlist: Netlist, grid: np.ndarray) -> list:
 
-    return tree
+    """Returns the boolean operation of every gate in the netlist, as placed in the given schematic."""
 
+    return [GATE_OPERATIONS[GATES[grid[row][column]]] for row, column in netlist.gates]
 
-def grid_output_trees(grid: np.ndarray, kmap: np.ndarray, final_gate: tuple[int, int]) -> dict[tuple, dict]:
 
-    """Creates a list of all possible output trees for a given base schematic."""
+def evaluate_netlist(netlist: Netlist, operations: list, inputs: str) -> bool:
 
-    height, width = kmap.shape  # Dimensions
-    trees = {}  # Dictionary to store trees
-    bar = IncrementalBar("Output Trees", max=(height - 1) * (width - 1))  # Progress bar
+    """Evaluates the netlist for a single input combination, given as a string of bits, into a boolean output."""
 
-    for row in range(1, height):
-        for column in range(1, width):
+    values = [bit == "1" for bit in inputs]  # Input nodes
 
-            bar.next()  # Progress
+    for operation, (child1, child2) in zip(operations, netlist.children):
+        values.append(operation(values[child1], values[child2]))  # Gate nodes follow the inputs
 
-            # Combines the inputs into one string where each bit corresponds to an input
-            left_inputs = kmap[row][0]
-            top_inputs = kmap[0][column]
-            inputs = left_inputs + top_inputs
+    return values[-1]  # Final gate
 
-            # Get the tree of the input
-            tree = output_tree(grid, final_gate, inputs)
 
-            # Store the tree in the dictionary
-            trees[(row, column)] = tree
+def input_vector(inputs: int, bit: int) -> np.ndarray:
 
-    bar.finish()
+    """
+    Returns the packed truth table of a single input. Combination m sets input k to bit k of m, and is stored at bit
+    m % 64 of word m // 64.
+    """
 
-    return trees
+    words = max(1, 2 ** inputs // WORD_BITS)  # Small schematics still use one whole word
 
+    if bit < len(INPUT_PATTERNS):  # Input alternates within every word
+        return np.full(words, INPUT_PATTERNS[bit], dtype=np.uint64)
 
-def evaluate_tree(grid: np.ndarray, tree: dict) -> bool:
+    # Input alternates between whole words
+    word_index = np.arange(words)
+    return np.where((word_index >> (bit - len(INPUT_PATTERNS))) & 1, ALL_ONES, np.uint64(0))
 
-    """Evaluates the given tree into a single boolean output."""
 
-    tree = tree.copy()  # Important to not modify original tree
-    order = list(reversed(tree.keys()))  # Reverse the list so we evaluate from inputs upward
-    final_gate = list(tree.keys())[0]  # Final gate coordinates
+def gate_code_matrix(netlist: Netlist, grids: list[np.ndarray]) -> np.ndarray:
 
-    for key in order:
+    """Returns the gate codes of every schematic passed as a (versions x gates) matrix, in netlist order."""
 
-        data_type = type(tree[key][0])
+    rows, columns = zip(*netlist.gates)
+    symbols = np.stack(grids)[:, rows, columns]  # Gate symbols of every version
 
-        if data_type == tuple:  # Gate found
+    return GATE_CODES[symbols]
 
-            gate1, gate2 = tree[key]  # Unpack gates
 
-            # Check if the gates listed have been evaluated
-            if type(tree[gate1][0]) == bool and type(tree[gate2][0]) == bool:
+def truth_table_batch(netlist: Netlist, gate_codes: np.ndarray) -> np.ndarray:
 
-                # Get the operation of the gate used as key
-                operation = GATE_OPERATIONS[GATES[grid[key[0]][key[1]]]]
+    """
+    Evaluates every input combination of a batch of schematics at once, given their (versions x gates) code matrix.
+    Returns a (versions x words) array where each row is the packed truth table of one version.
+    """
 
-                gate1, gate2 = tree[gate1][0], tree[gate2][0]  # Unpack inputs
-                result = operation(gate1, gate2)  # Apply boolean operation
+    inputs = netlist.inputs
+    gate_count = len(netlist.gates)
 
-                # Store result under gate coordinates
-                tree[key] = [result]  # Stored in list to prevent error with variable data_type's initialization
+    # Count how often each node is read, so vectors can be dropped once nothing else needs them
+    remaining = np.bincount(netlist.children.ravel(), minlength=inputs + gate_count).tolist()
+    values = [None] * (inputs + gate_count)
 
-        else:  # Input found
+    for _, children in enumerate(netlist.children):
 
-            # Get the operation of the gate used as key
-            operation = GATE_OPERATIONS[GATES[grid[key[0]][key[1]]]]
+        operands = []
+        for child in children:
 
-            in1, in2 = tree[key]  # Unpack inputs
-            result = operation(bool(int(in1)), bool(int(in2)))  # Apply boolean operation
+            if values[child] is None:  # Inputs are only built when first used, and shared by every version
+                values[child] = input_vector(inputs, child)[None, :]
+            operands.append(values[child])
 
-            # Store result under gate coordinates
-            tree[key] = [result]  # Stored in list to prevent error with variable data_type's initialization
+            remaining[child] -= 1
+            if remaining[child] == 0:
+                values[child] = None  # Free the vector
 
-    return tree[final_gate][0]
+        # Coefficients of each version's gate, as columns so they broadcast across words
+        c0, c1, c2, c3 = (column[:, None] for column in GATE_COEFFICIENTS[gate_codes[:, _]].T)
+        a, b = operands
+        values[inputs + _] = c0 ^ (c1 & a) ^ (c2 & b) ^ (c3 & a & b)
 
+    tables = values[-1]
+    count("gates_evaluated", gate_codes.size)
 
-# Visualization functions
-def create_map_array(inputs: int) -> np.ndarray:
+    if 2 ** inputs < WORD_BITS:  # Clear the unused bits of a partially filled word
+        tables &= np.uint64(2 ** 2 ** inputs - 1)
+
+    return tables
+
+
+def truth_table(netlist: Netlist, grid: np.ndarray) -> np.ndarray:
+
+    """Evaluates every input combination of a schematic at once and returns its output as a packed truth table."""
+
+    return truth_table_batch(netlist, gate_code_matrix(netlist, [grid]))[0]
+
+
+class IncrementalEvaluator:
+
+    """
+    Evaluates the truth tables of versions of a base schematic one after another, keeping the vector of every gate from
+    the last version. Only the gates whose symbol changed, and the gates that read from them on the way to the final
+    gate, are evaluated again, so versions that differ in one gate cost a vector operation per level of the schematic
+    rather than one per gate. Vectors are updated in place, so no memory is allocated after the first version.
+    """
+
+    def __init__(self, netlist: Netlist):
+
+        self.netlist = netlist
+        self.codes = None  # Gate codes of the last version
+        inputs, gate_count = netlist.inputs, len(netlist.gates)
+
+        self.vectors = [input_vector(inputs, _) for _ in range(inputs)] + [
+            np.empty(max(1, 2 ** inputs // WORD_BITS), dtype=np.uint64) for _ in range(gate_count)
+        ]
+
+        # Gates reading each gate's output, which is more than one where a gate is forked
+        self.parents = [[] for _ in range(gate_count)]
+        for gate, children in enumerate(netlist.children.tolist()):
+            for child in children:
+                if child >= inputs:
+                    self.parents[child - inputs].append(gate)
+
+    def table(self, gate_codes: np.ndarray) -> np.ndarray:
+
+        """Returns the packed truth table of a version, given its row of the gate code matrix."""
 
-    """Returns an empty array representation of the Karnaugh map given the number of inputs."""
+        inputs = self.netlist.inputs
 
-    top, left = split_gates(inputs)  # Split inputs across axes of Karnaugh map
+        if self.codes is None:  # Nothing to reuse
+            changed = range(len(gate_codes))
+        else:
+            changed = np.flatnonzero(gate_codes != self.codes).tolist()
 
-    # Generate labels for each axes of the Karnaugh map
-    left_index = generate_index(left)
-    top_index = generate_index(top)
+        # Everything that reads a changed gate, directly or not, changes too
+        stale = set(changed)
+        unvisited = list(changed)
+        while unvisited:
+            for parent in self.parents[unvisited.pop()]:
+                if parent not in stale:
+                    stale.add(parent)
+                    unvisited.append(parent)
 
-    # Karnaugh map full of 0s
-    height, width = len(left_index) + 1, len(top_index) + 1  # Dimensions (additional row and column for labels)
-    kmap = np.full((height, width), "0", dtype=object)  # Populate with false, only true will need to be recorded
+        for gate in sorted(stale):  # Gate order is topological, so children are always up to date
 
-    # Filling labels
-    kmap[0][0] = "#"  # Unused corner
+            a, b = (self.vectors[child] for child in self.netlist.children[gate])
+            operation, inverted = GATE_UFUNCS[gate_codes[gate]]
+            out = self.vectors[inputs + gate]
 
-    # Fill left column with left labels
-    for _ in range(len(left_index)):
-        kmap[_ + 1][0] = left_index[_]
+            operation(a, b, out=out)
+            if inverted:
+                np.invert(out, out=out)
 
-    # Fill top row with top labels
-    for _ in range(len(top_index)):
-        kmap[0][_ + 1] = top_index[_]
+        self.codes = np.array(gate_codes)
+        count("gates_evaluated", len(stale))
 
-    return kmap
+        table = self.vectors[-1].copy()
+        if 2 ** inputs < WORD_BITS:  # Clear the unused bits of a partially filled word
+            table &= np.uint64(2 ** 2 ** inputs - 1)
 
+        return table
 
-def populate_map(kmap: np.ndarray, grid: np.ndarray, trees: dict[tuple, dict]) -> np.ndarray:
+
+def incremental_evaluator(netlist: Netlist) -> IncrementalEvaluator | None:
+
+    """
+    Returns an incremental evaluator for the netlist if its truth tables are long enough for one to be faster than
+    evaluating batches of versions together, even when every gate changes between versions, and None otherwise.
+    """
+
+    if max(1, 2 ** netlist.inputs // WORD_BITS) >= INCREMENTAL_WORDS:
+        return IncrementalEvaluator(netlist)
+
+    return None
+
+
+def table_hash(table: np.ndarray) -> bytes:
+
+    """Returns a compact hash of a packed truth table, identical for schematics that compute the same function."""
+
+    return hashlib.blake2b(table.tobytes(), digest_size=16).digest()
+
+
+def functional_filter(netlist: Netlist, seen=None):
+
+    """
+    Returns a function that accepts a schematic only if no previously accepted schematic has the same truth table,
+    returning the truth table of accepted schematics so it doesn't have to be evaluated again, and None otherwise. Seen
+    truth tables are kept as hashes in the keys of a dictionary, so each check is O(1) and the hashes stay in the order
+    they were accepted. Passing the dictionary carries on from the schematics it already holds.
+    """
+
+    if seen is None:
+        seen = {}  # Hashes of accepted truth tables
+
+    evaluator = incremental_evaluator(netlist)
+
+    def is_new_function(grid: np.ndarray) -> np.ndarray | None:
+
+        if evaluator is not None:
+            table = evaluator.table(gate_code_matrix(netlist, [grid])[0])
+        else:
+            table = truth_table(netlist, grid)
+
+        digest = table_hash(table)
+        if digest in seen:  # Same Karnaugh map as an accepted version
+            return None
+
+        seen[digest] = None
+        return table
+
+    return is_new_function
+
+
+# Visualization functions
+def create_map_array(inputs: int) -> KarnaughMap:
+
+    """Returns an empty Karnaugh map given the number of inputs."""
+
+    return KarnaughMap(inputs)
+
+
+def populate_map(kmap: KarnaughMap, grid: np.ndarray, netlist: Netlist) -> KarnaughMap:
 
     """Returns the populated Karnaugh map of a given schematic."""
 
-    new_kmap = kmap.copy()  # Create a copy of the kmap so the base isn't modified.
-    height, width = kmap.shape  # Dimensions
+    return map_from_table(kmap, truth_table(netlist, grid), netlist.inputs)
 
-    for row in range(1, height):
-        for column in range(1, width):
 
-            # Get the result of the input
-            coord = (row, column)
-            tree = trees[coord]
-            output = evaluate_tree(grid, tree)
+def map_from_table(kmap: KarnaughMap, table: np.ndarray, inputs: int) -> KarnaughMap:
 
-            # Store the input at the current spot
-            new_kmap[row][column] = int(output)
+    """Returns a new Karnaugh map the size of the base map, filled in from a packed truth table one chunk at a time."""
+
+    new_kmap = KarnaughMap(kmap.inputs)
+
+    for start, stop in new_kmap.row_chunks():
+
+        # Look up each cell's bit in the packed truth table
+        index = kmap_index(inputs, start, stop)
+        cells = (table[index // WORD_BITS] >> (index % WORD_BITS).astype(np.uint64)) & np.uint64(1)
+        new_kmap.fill(start, stop, cells.astype(np.uint8))
 
     return new_kmap
 
 
-def save_kmap(kmap: np.ndarray, filename: str, index: int):
+def kmap_text(kmap: KarnaughMap):
 
-    """Saves the Karnaugh map to a text file, completely formatted."""
+    """Yields the completely formatted text of a Karnaugh map's file in chunks of rows."""
 
-    longest_char = len(kmap[1][0])  # Calculate the longest character for spacing
+    left, top = kmap.left, kmap.top  # The left labels are the longest, and every cell is padded to fit them
+    cell_width = left + 1
 
-    with open(f"{KMAP_FOLDER}/{filename} #{index + 1}.txt", 'w') as file:  # Open file for writing
+    # Write which inputs are on which side
+    yield "Left side inputs: " + ", ".join(input_name(_) for _ in range(left)) + "\n"
+    yield "Top side inputs: " + ", ".join(input_name(_) for _ in range(left, left + top)) + "\n\n"
 
-        # Write which inputs are on which side
-        left, top = longest_char, len(kmap[0][1])  # Determining the amount of inputs on each side
-        input_names = list(INPUT_IMAGES.keys())  # Names of inputs
+    # Label row, as a block of characters with one cell per row
+    header = np.full((kmap.shape[1], cell_width), ord(" "), dtype=np.uint8)
+    header[:, :top] = axis_labels(top)
+    yield "#" + " " * left + header.tobytes().decode("ascii") + "\n"
 
-        # Left side inputs
-        file.write("Left side inputs: ")
-        for _ in range(left):
-            if _ == left - 1:  # No comma on final input in list
-                file.write(input_names[_] + "\n")
-            else:
-                file.write(input_names[_] + ", ")
+    for start, stop in kmap.row_chunks():
 
-        # Top side inputs
-        file.write("Top side inputs: ")
-        for _ in range(left, left + top):
-            if _ == left + top - 1:  # No comma on final input in list
-                file.write(input_names[_] + "\n\n")
-            else:
-                file.write(input_names[_] + ", ")
+        # (rows x cells x characters), where the first cell of each row is its label
+        text = np.full((stop - start, kmap.shape[1] + 1, cell_width), ord(" "), dtype=np.uint8)
+        text[:, 0, :left] = axis_labels(left, start, stop)
+        text[:, 1:, 0] = kmap.rows(start, stop) + ord("0")
 
-        for row in kmap:
-            new_row = ""  # Initialize new row
-            for value in row:
-                new_row += f"{value}{' ' * (longest_char - len(str(value)) + 1)}"  # Store the formatted row information
-            file.write(new_row + "\n")  # Save the row to its file
+        lines = np.concatenate([text.reshape(stop - start, -1), np.full((stop - start, 1), ord("\n"), np.uint8)], 1)
+        yield lines.tobytes().decode("ascii")
+
+
+def format_kmap(kmap: KarnaughMap) -> str:
+
+    """Returns the Karnaugh map as the completely formatted text of its file."""
+
+    return "".join(kmap_text(kmap))
+
+
+def kmap_path(filename: str, index: int) -> str:
+
+    """Returns the path of a Karnaugh map file."""
+
+    return f"{KMAP_FOLDER}/{filename} #{index + 1}.txt"
+
+
+def save_kmap(kmap: KarnaughMap, filename: str, index: int):
+
+    """Saves the Karnaugh map to a text file, completely formatted."""
+
+    with open(kmap_path(filename, index), 'w') as file:  # Open file for writing
+        file.writelines(kmap_text(kmap))  # Written a chunk at a time
 
 
 # Batch functions
-def create_kmap_batch(kmap: np.ndarray, unique_grids: dict, trees: dict[tuple, dict], filename: str) -> dict:
+def kmap_batch_size(inputs: int, window=KMAP_WINDOW) -> int:
+
+    """Returns how many versions are evaluated together, as many as fit in a bounded amount of memory."""
+
+    words = max(1, 2 ** inputs // WORD_BITS)
+
+    return max(1, min(window, KMAP_BATCH_WORDS // words))
+
+
+def kmap_stream(kmap: KarnaughMap, netlist: Netlist, grids, filename: str, window=KMAP_WINDOW, writers=1,
+                archive=None):
+
+    """
+    Evaluates and saves the Karnaugh map of each (index, grid, table) passed, then yields (index, grid, kmap). Tables
+    that are None are evaluated here, and the others (already evaluated by a functional filter) are used as they are.
+    Versions are pulled and evaluated together in windows, so at most one window of versions is held in memory at once.
+    Files are written by a number of background writer threads while the next maps are evaluated. If an archive writer
+    is passed, truth tables are added to it instead of saving text files.
+    """
+
+    batch_size = kmap_batch_size(netlist.inputs, window)
+    evaluator = None  # Only made once a table has to be evaluated here, since it holds a vector for every gate
+    grids = iter(grids)
+
+    with Writer(writers) as writer:
+        while batch := list(itertools.islice(grids, batch_size)):
+
+            # Truth tables for the schematics of the batch that don't have one yet
+            tables = [table for _, _, table in batch]
+            missing = [row for row, table in enumerate(tables) if table is None]
+
+            if missing:
+
+                gate_codes = gate_code_matrix(netlist, [batch[_][1] for _ in missing])
+                evaluator = evaluator or incremental_evaluator(netlist)
+
+                if evaluator is not None:  # Long tables, reusing the gates that didn't change from the last version
+                    evaluated = [evaluator.table(codes) for codes in gate_codes]
+                else:
+                    evaluated = truth_table_batch(netlist, gate_codes)
+
+                for row, table in zip(missing, evaluated):
+                    tables[row] = table
+
+            for (index, grid, _), table in zip(batch, tables):
+
+                # Create the Karnaugh map for each schematic and save it under the index matching its schematic
+                new_kmap = map_from_table(kmap, table, netlist.inputs)  # Fill in the matching truth table
+                if archive is not None:
+                    archive.add_table(table)
+                else:
+                    writer.write(kmap_path(filename, index), kmap_text(new_kmap))  # Save to text file
+
+                yield index, grid, new_kmap
+
+
+def create_kmap_batch(kmap: KarnaughMap, unique_grids: dict, netlist: Netlist, filename: str) -> dict:
 
     """
     Returns a dictionary of Karnaugh maps that match the batch of unique schematics passed. Saves the maps to a text
@@ -337,19 +649,15 @@ def create_kmap_batch(kmap: np.ndarray, unique_grids: dict, trees: dict[tuple, d
     """
 
     unique_kmaps = {}  # Dictionary to store Karnaugh maps
-    num_grids = len(unique_grids)
-    bar = IncrementalBar("Karnaugh Maps", max=num_grids)  # Progress bar
+    bar = Progress("Karnaugh Maps", len(unique_grids))  # Progress bar
 
-    # Loop through all schematics
-    for _ in range(num_grids):
+    for index, _, new_kmap in kmap_stream(kmap, netlist, ((index, grid, None) for index, grid in unique_grids.items()),
+                                          filename):
 
         # Progress display
         bar.next()
 
-        # Create the Karnaugh map for each schematic and save it under the index matching its schematic
-        new_kmap = populate_map(kmap, unique_grids[_], trees)  # Get the matching truth table
-        unique_kmaps[_] = new_kmap  # Store it in a dictionary
-        save_kmap(new_kmap, filename, _)  # Save to text file
+        unique_kmaps[index] = new_kmap  # Store it in a dictionary
 
     bar.finish()
 
@@ -0,0 +1,86 @@
+# On-disk cache of wired base layouts
+__author__ = "Matteo Golin"
+
+# Imports
+import functools
+import hashlib
+import inspect
+import os
+import shutil
+import numpy as np
+import karnaugh
+import schematic
+import symbols
+from karnaugh import Netlist, compile_netlist
+from metrics import count
+from schematic import create_grid, wire_grid, get_gate_coords
+from writer import replacing
+
+# Constants
+CACHE_FOLDER = "cache"
+
+
+@functools.cache
+def layout_version() -> str:
+
+    """
+    Returns a hash of the code that builds layouts. The cache is only valid for the code that built it, so its folder is
+    named after this. Reading the source is slow, so it is only hashed the first time a layout is needed.
+    """
+
+    return hashlib.sha256("".join([
+        inspect.getsource(schematic),
+        inspect.getsource(symbols),
+        inspect.getsource(karnaugh.previous_gates),
+        inspect.getsource(karnaugh.compile_netlist)
+    ]).encode()).hexdigest()[:16]
+
+
+def build_layout(inputs: int) -> tuple[np.ndarray, Netlist]:
+
+    """Creates and wires the base grid for the number of inputs, and compiles its netlist."""
+
+    base_grid = create_grid(inputs)  # Create the grid
+    wire_grid(base_grid)  # Wire the grid
+
+    return base_grid, compile_netlist(base_grid, get_gate_coords(base_grid))
+
+
+def save_array(array: np.ndarray, path: str):
+
+    """Saves an array through a temporary file, so other processes never load a partly written file."""
+
+    with replacing(path) as temporary, open(temporary, "wb") as file:
+        np.save(file, array)
+
+
+def load_layout(inputs: int) -> tuple[np.ndarray, Netlist]:
+
+    """
+    Returns the wired base grid and netlist for the number of inputs. They are built once per version of the layout
+    code and kept in the cache folder, then memory mapped read-only on later runs.
+    """
+
+    folder = f"{CACHE_FOLDER}/{layout_version()}/{inputs}"
+    files = {name: f"{folder}/{name}.npy" for name in ("grid", "gates", "children")}
+
+    if not all(os.path.isfile(path) for path in files.values()):
+
+        # Layouts from older versions of the code will never be read again
+        if os.path.isdir(CACHE_FOLDER):
+            for version in os.listdir(CACHE_FOLDER):
+                if version != layout_version():
+                    shutil.rmtree(f"{CACHE_FOLDER}/{version}", ignore_errors=True)
+
+        base_grid, netlist = build_layout(inputs)
+        count("layouts_built")
+
+        os.makedirs(folder, exist_ok=True)
+        save_array(base_grid, files["grid"])
+        save_array(np.array(netlist.gates, dtype=np.int32), files["gates"])
+        save_array(netlist.children, files["children"])
+
+    arrays = {name: np.load(path, mmap_mode="r") for name, path in files.items()}
+    gate_coords = [(row, column) for row, column in arrays["gates"].tolist()]
+
+    return arrays["grid"], Netlist(inputs, gate_coords, arrays["children"])
@@ -2,54 +2,152 @@
 __author__ = "Matteo Golin"
 
 # Imports
-import numpy as np
+import atexit
+import os
+import random
+import signal
+import sys
 import time
-from schematic import create_grid, wire_grid, create_grid_batch, count_gates, validate_version_count, get_gate_coords
-from image import create_image_batch
-from karnaugh import create_map_array, create_kmap_batch, grid_output_trees
 from commands import parser, clear_output
-
-np.set_printoptions(threshold=np.inf)  # Prints more grids without them getting cut off
+from settings import INPUT_LETTERS
 
 # Program parameters
 arguments = parser.parse_args()
 
+# NumPy, Pillow and the pipeline are only imported once the arguments are read, so -h doesn't wait for them
+import numpy as np
+from schematic import count_versions, grid_stream, seed_key, validate_version_count
+from image import create_image_batch
+from karnaugh import create_map_array, kmap_stream, functional_filter
+from layouts import layout_version, load_layout
+from archive import ArchiveWriter, archive_path
+from checkpoints import Checkpoint, checkpoint_path, first_incomplete, load_checkpoint, remove_temporary, \
+    version_complete
+from shards import shard_name, shard_range
+import metrics
+from metrics import Progress, stage, status, timed
+
+np.set_printoptions(threshold=np.inf)  # Prints more grids without them getting cut off
+
 inputs = arguments.i
 versions = arguments.v
 scalar = arguments.s
 filename = arguments.fname
 
+# Karnaugh maps double in size with every input, so only posters go past the single letter inputs
+if inputs > INPUT_LETTERS and not arguments.poster:
+    parser.error(f"more than {INPUT_LETTERS} inputs need -poster (GOT: {inputs})")
+if arguments.poster and arguments.unique:
+    parser.error("-unique compares Karnaugh maps, which -poster skips")
+if arguments.poster and arguments.noimages and not arguments.archive:
+    parser.error("-poster with -noimages only makes something with -archive")
+if arguments.resume and (arguments.clear or arguments.archive):
+    parser.error("-resume can't be used with -clear, which deletes the output, or -archive, which is made at the end")
+if arguments.shard and arguments.unique:
+    parser.error("-unique skips versions depending on the versions before them, so it can't be split into shards")
+if arguments.shard and arguments.seed is None and not arguments.all:
+    parser.error("-shard needs -seed, so every shard draws from the same order of versions")
+
 # Clear the output folder
 if arguments.clear:
     clear_output()
 
-start = time.time()  # Record start time
+metrics.configure(arguments.metrics, arguments.quiet)  # Where numbers are reported
+start, start_cpu = time.time(), time.process_time()  # Record start time
+
+# Wired base grid and the gate structure shared by every version, from the cache when possible
+with stage("layout"):
+    base_grid, netlist = load_layout(inputs)
+gate_count = len(netlist.gates)  # Count how many gates are in the grid
+
+if arguments.all:  # Every gate order, picked the same way every run
+    versions = count_versions(gate_count)
+    order = arguments.order or "sequential"
+    key = bytes(16) if arguments.seed is None else seed_key(arguments.seed)
+    status(f"Making all {versions} versions.\n")
+else:
+    validate_version_count(versions, gate_count, inputs)  # Ensure that the version count is <= # of possible orders
+    order = arguments.order or "random"
+    key = random.randbytes(16) if arguments.seed is None else seed_key(arguments.seed)  # Picks which are drawn
+
+# A shard makes its slice of the versions, numbered as in the whole job, and is saved under its own name
+name, first, total = filename, 0, versions  # Name of the checkpoint or archive, first index and versions in the job
+if arguments.shard:
+    indices = shard_range(versions, *arguments.shard)
+    if not indices:
+        parser.error(f"there are fewer versions than shards, so shard {'/'.join(map(str, arguments.shard))} is empty")
+    name, first, versions = shard_name(filename, *arguments.shard), indices.start, len(indices)
+    status(f"Making shard {arguments.shard[0]} of {arguments.shard[1]}: versions #{first + 1} to #{indices.stop}.\n")
+
+status("Grid layout created.\n")  # Display that the grid layout has been created
+
+# Checkpoints, so that a run that dies partway can be picked back up with -resume
+checkpoint = None
+layout = f"{layout_version()}/{inputs}/{order}"  # Checkpoints only apply to the layout and order drawn for
+kmaps, images = not arguments.poster, not arguments.noimages  # Files each version has
+
+if arguments.resume:
+
+    if not os.path.isfile(checkpoint_path(name)):
+        parser.error(f"there is no checkpoint to resume at {checkpoint_path(name)}")
+
+    checkpoint = load_checkpoint(checkpoint_path(name))
+    if checkpoint.layout != layout or checkpoint.unique != arguments.unique or checkpoint.first != first or \
+            checkpoint.total not in (None, total):  # Checkpoints from before the total was saved
+        parser.error("the checkpoint is for a different number of inputs, layout, -order, -unique or -v setting")
+
+    # Draw again from the first version missing a file, and skip the later ones that were finished
+    remove_temporary(filename, name, first + versions, first)  # Files cut off when the run stopped
+    resume = first_incomplete(filename, first + len(checkpoint.positions), kmaps, images, first)
+    checkpoint.rewind(resume)
+    status(f"Resuming from version #{resume + 1}.\n")
+
+elif not arguments.archive:
+    checkpoint = Checkpoint(checkpoint_path(name), key, layout, arguments.unique, first=first, total=total)
+    checkpoint.save()  # Right away, so even a run killed before the first interval can be resumed
+
+if checkpoint is not None:
+    atexit.register(checkpoint.save)  # Also saved when stopped early
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))  # Preemption exits like Ctrl+C
 
-# Create a base grid
-base_grid = create_grid(inputs)  # Create the grid
-wire_grid(base_grid)  # Wire the grid
-gate_count = count_gates(base_grid)  # Count how many gates are in the grid
+# Each version flows through sampling, evaluation, its Karnaugh map and its image before the next window is drawn
+seen = checkpoint.seen if checkpoint is not None else None  # Karnaugh maps of the versions already made
+accept = functional_filter(netlist, seen) if arguments.unique else None  # Skip versions with an existing Karnaugh map
+unique_grids = timed("sampling", grid_stream(base_grid, versions, accept, checkpoint, order, key, first))
 
-validate_version_count(versions, gate_count, inputs)  # Ensure that the version count is <= # of possible permutations
+if arguments.resume:
+    unique_grids = ((index, grid, table) for index, grid, table in unique_grids
+                    if not version_complete(filename, index, kmaps, images))  # Already saved before the run stopped
+archive = ArchiveWriter(archive_path(name), base_grid, netlist, total) if arguments.archive else None
 
-print("Grid layout created.\n")  # Display that the grid layout has been created
+if archive is not None:
+    unique_grids = timed("archive", archive.stream(unique_grids))  # Records the gates of each version
 
-# Create batch of random grids
-unique_grids = create_grid_batch(base_grid, versions)
-print()
+if not arguments.poster:  # Posters go straight from layout to image
+    kmap = create_map_array(inputs)  # Base Karnaugh map
+    unique_grids = timed("kmaps", kmap_stream(kmap, netlist, unique_grids, filename, arguments.window,
+                                              arguments.writers, archive))  # Saves Karnaugh maps
+unique_grids = ((index, grid) for index, grid, _ in unique_grids)  # Images only need the grid
 
-# Karnaugh maps
-kmap = create_map_array(inputs)  # Base Karnaugh map
-final_gate = get_gate_coords(base_grid)[-1]  # Starting point to find outputs of a schematic
-trees = grid_output_trees(base_grid, kmap, final_gate)  # Generate output trees for the base schematic
-print()
-unique_kmaps = create_kmap_batch(kmap, unique_grids, trees, filename)  # Get unique Karnaugh maps
-print()
+if arguments.noimages:
+    bar = Progress("Versions", versions)
+    for _ in unique_grids:  # Run the earlier stages
+        bar.next()
+    bar.finish()
+else:
+    with stage("images") as images:
+        images["versions"] = create_image_batch(unique_grids, filename, scalar, versions, arguments.workers,
+                                                arguments.renderer, arguments.writers, archive)  # Saves images
+    status("")
 
-# Create images
-create_image_batch(unique_grids, filename, scalar)
-print()
+if archive is not None:
+    with stage("archive"):
+        archive.close()  # Put the archive together
 
 end = time.time()  # Record end time
 
-print(f"Generation completed in {time.strftime('%H:%M:%S', time.gmtime(end - start))}")  # Success message
+made = metrics.STAGES["sampling"]["versions"]  # Versions that made it through
+metrics.report(inputs=inputs, versions=made, wall=end - start, cpu=time.process_time() - start_cpu,
+               versions_per_second=made / (end - start))
+status(f"Generation completed in {time.strftime('%H:%M:%S', time.gmtime(end - start))}")  # Success message
+status(f"{made} versions made, {made / (end - start):.1f} per second")
@@ -0,0 +1,21 @@
+# Puts the shards of a job together
+__author__ = "Matteo Golin"
+
+# Imports
+import sys
+from commands import merge_parser
+
+# Program parameters
+arguments = merge_parser.parse_args()
+
+# The pipeline is only imported once the arguments are read, so -h doesn't wait for it
+from archive import archive_path
+from shards import merge_shards
+
+try:
+    versions = merge_shards(arguments.fname)
+except ValueError as error:
+    print(f"The shards can't be merged: {error}.")
+    sys.exit(1)
+
+print(f"Merged {versions} versions into {archive_path(arguments.fname)}.")
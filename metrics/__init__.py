@@ -0,0 +1,159 @@
+# Instrumentation of the pipeline
+__author__ = "Matteo Golin"
+
+# Imports
+import collections
+import contextlib
+import json
+import threading
+import time
+from progress.bar import IncrementalBar
+
+# Constants
+PROGRESS_INTERVAL = 0.5  # Seconds between progress updates
+PROGRESS_SUFFIX = "%(index)d/%(max)d - %(eta_td)s left"  # Count and estimated time left shown after each bar
+
+# Recorded by every stage as it runs
+COUNTERS = collections.Counter()  # Named event counts, such as bytes written
+STAGES = {}  # Stage name to its wall time, CPU time and versions
+SETTINGS = {"quiet": False, "file": None}  # Terminal output, and the file metrics are written to
+
+counter_lock = threading.Lock()  # Counters are also updated by writer threads
+running = []  # [wall, CPU] time spent in nested stages, for each stage being timed
+
+
+def configure(path=None, quiet=False):
+
+    """Sets where metrics are written as JSON lines, if anywhere, and whether progress is shown in the terminal."""
+
+    SETTINGS["quiet"] = quiet
+    SETTINGS["file"] = open(path, "w") if path is not None else None
+
+
+def emit(kind: str, **fields):
+
+    """Writes a record to the metrics file as one line of JSON, if there is a metrics file."""
+
+    if SETTINGS["file"] is not None:
+        SETTINGS["file"].write(json.dumps({"type": kind, "time": time.time(), **fields}) + "\n")
+        SETTINGS["file"].flush()  # So the numbers can be collected while the run goes on
+
+
+def status(message: str):
+
+    """Prints a status message, unless in quiet mode."""
+
+    if not SETTINGS["quiet"]:
+        print(message)
+
+
+def count(name: str, amount=1):
+
+    """Adds to a counter."""
+
+    with counter_lock:
+        COUNTERS[name] += amount
+
+
+@contextlib.contextmanager
+def stage(name: str):
+
+    """
+    Times the block as part of a stage, and yields the stage's record so versions can be added to it. Time spent in
+    stages nested inside the block, such as pulling from an earlier stage of a stream, only counts towards those stages.
+    CPU time is for the whole process, so it includes background threads.
+    """
+
+    record = STAGES.setdefault(name, {"wall": 0.0, "cpu": 0.0, "versions": 0})
+    running.append([0.0, 0.0])
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    try:
+        yield record
+    finally:
+
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        nested_wall, nested_cpu = running.pop()
+
+        record["wall"] += wall - nested_wall
+        record["cpu"] += cpu - nested_cpu
+
+        if running:  # Nested in another stage, which shouldn't count this time as its own
+            running[-1][0] += wall
+            running[-1][1] += cpu
+
+
+def timed(name: str, items):
+
+    """Yields the items of a stream, timing the work done to produce each one as a stage, and counting them."""
+
+    items = iter(items)
+
+    while True:
+
+        with stage(name) as record:
+            item = next(items, StopIteration)
+
+        if item is StopIteration:
+            return
+
+        record["versions"] += 1
+        yield item
+
+
+class Progress:
+
+    """
+    Progress of a stage, shown as a bar that is redrawn at most once per PROGRESS_INTERVAL and also written to the
+    metrics file at that rate, with the rate so far and an estimate of the time left. Nothing is shown in quiet mode.
+    """
+
+    def __init__(self, name: str, total: int):
+
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self.last = 0.0  # When progress was last shown
+        self.bar = None if SETTINGS["quiet"] else IncrementalBar(name, max=total, suffix=PROGRESS_SUFFIX)
+
+    def show(self):
+
+        if self.bar is not None:
+            self.bar.goto(self.done)
+
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if self.done and elapsed else None
+        remaining = (self.total - self.done) / rate if rate else None
+        emit("progress", stage=self.name, done=self.done, total=self.total, versions_per_second=rate,
+             seconds_left=remaining)
+        self.last = time.monotonic()
+
+    def next(self):
+
+        self.done += 1
+
+        if time.monotonic() - self.last >= PROGRESS_INTERVAL:
+            self.show()
+
+    def finish(self):
+
+        self.show()
+        if self.bar is not None:
+            self.bar.finish()
+
+
+def report(**run):
+
+    """Writes the time of each stage, the counters and the details of the run to the metrics file, then closes it."""
+
+    for name, record in STAGES.items():
+        throughput = record["versions"] / record["wall"] if record["versions"] and record["wall"] else None
+        emit("stage", stage=name, **record, versions_per_second=throughput)
+
+    emit("counters", **COUNTERS)
+    emit("run", **run)
+
+    if SETTINGS["file"] is not None:
+        SETTINGS["file"].close()
+        SETTINGS["file"] = None
@@ -2,307 +2,310 @@
 __author__ = "Matteo Golin"
 
 # Imports
-import collections
+import hashlib
 import numpy as np
-import operator
 import random
-from progress.bar import IncrementalBar
-from image import INPUT_IMAGES, WIRES, GATE_GENER, GATES
+from metrics import Progress, count, status
+from settings import ORDERS
+from symbols import EMPTY, INPUT, WIRES, GATE_GENER, GATES
+
+# Constants
+GATE_ORDER_BLOCK = 2 ** 12  # Gate orders drawn at once
+LIMB_DIGITS = 24  # Most gates held in one 64 bit limb, since 6 ** 24 < 2 ** 63
+FEISTEL_ROUNDS = 4  # Rounds of the permutation that shuffles gate orders
+CONNECTION_POINTS = [  # A gate comes after any cell holding two wires
+    WIRES["merge"], WIRES["dual up"], WIRES["dual down"], WIRES["dual bend up"], WIRES["dual bend down"]
+]
 
 
 # Functions
 def create_grid(inputs: int) -> np.ndarray:
 
     """
-    Returns a grid of size dimension x dimension, populated with inputs in the first column.
+    Returns a coded grid of size dimension x dimension, populated with inputs in the first column.
     """
 
-    # Character symbols for inputs
-    characters = list(INPUT_IMAGES.keys()) * (inputs // 26 + 1)
-
     # Calculating necessary grid length based on inputs
     bin_length = len(str(bin(inputs - 1))) - 2
     width = 2 * bin_length + 1
 
-    grid = np.full((width, inputs), " ")
-    grid[0] = [characters[_] for _ in range(inputs - 1, -1, -1)]
+    grid = np.full((width, inputs), EMPTY, dtype=np.uint8)
+    grid[0] = INPUT  # The first input is in the last column
 
     return grid
 
 
-def wire_inputs(grid: np.ndarray):
-
-    """Connects wires to the input row of the grid."""
+def wire_inputs(n: int) -> list[int]:
 
-    # Wire row = grid[1]
+    """Returns the wire row that connects the inputs to the first row of gates."""
 
-    n = len(grid[0])  # Number of inputs
+    wires = [EMPTY] * n
     center_most = (n - 1) // 2  # Center-most input
 
     if n % 2 != 0:  # If n is odd
 
-        if ((n - 1) / 2) % 2 != 0:  # If (n - 1) / 2 is odd
-            grid[1][center_most] = WIRES["fork"]  # Center most input is forked
-
-            # Wires above and below fork bend to converge with above and below inputs
-            grid[1][center_most + 1] = WIRES["dual up"]
-            grid[1][center_most - 1] = WIRES["dual down"]
-
+        if ((n - 1) // 2) % 2 != 0:  # If (n - 1) / 2 is odd
+            fork = center_most  # Center most input is forked
         else:
-            grid[1][center_most + 1] = WIRES["fork"]  # Input just above center-most is forked
+            fork = center_most + 1  # Input just above center-most is forked
 
-            # Wires above and below fork bend to converge with above and below inputs
-            grid[1][center_most + 2] = WIRES["dual up"]
-            grid[1][center_most] = WIRES["dual down"]
+        # Wires above and below fork bend to converge with above and below inputs
+        wires[fork - 1:fork + 2] = [WIRES["dual down"], WIRES["fork"], WIRES["dual up"]]
 
-        # Now all that are left are input pairs, so I can iterate through pairs the same way I did evens, and just
-        # check if the places are filled
+    # Everything left is an input pair, and the pairs start on even columns on both sides of the fork
+    _ = 0
+    while _ < n:
 
-        for _ in range(n):
-            if grid[1][_] == " ":  # Check if point is empty first
+        if wires[_] != EMPTY:  # Part of the fork
+            _ += 1
+            continue
 
-                # I know that if the first cell I run into is empty, the one below it should be as well because of
-                # how the inputs pair up after the forking is complete.
+        if _ > center_most:  # Above center point
+            wires[_:_ + 2] = [WIRES["dual down"], WIRES["curve down"]]
+        else:  # Below center point
+            wires[_:_ + 2] = [WIRES["curve up"], WIRES["dual up"]]
 
-                if _ > center_most:  # Above center point
-                    grid[1][_] = WIRES["dual down"]  # Top
-                    grid[1][_ + 1] = WIRES["curve down"]  # Bottom
-                else:  # Below center point
-                    grid[1][_] = WIRES["curve up"]  # Top
-                    grid[1][_ + 1] = WIRES["dual up"]  # Bottom
+        _ += 2
 
-    else:  # If n is even
+    return wires
 
-        for _ in range(0, n, 2):  # Count by twos because wiring can be done in pairs
 
-            if _ > center_most:  # Above center point
-                grid[1][_] = WIRES["dual down"]  # Top
-                grid[1][_ + 1] = WIRES["curve down"]  # Bottom
-            else:  # Below center point
-                grid[1][_] = WIRES["curve up"]  # Top
-                grid[1][_ + 1] = WIRES["dual up"]  # Bottom
+def wire_gates(gates: list[int], n: int) -> list[int]:
 
-    return grid
+    """
+    Returns the wire row that connects a row of gates, given the columns of the gates in order, to the next row of
+    gates. Gates are wired in consecutive pairs, except for the center-most three when there is an odd number of gates,
+    where the middle gate is forked into both of its neighbours.
+    """
 
+    wires = [EMPTY] * n
+    center_most = (n - 1) // 2  # Center most input
 
-def add_gates(grid: np.ndarray, row: int):
+    def bridge(start: int, end: int, direction: int, end_wire: int):
 
-    """Adds gates to the current row."""
+        """Joins two gates that have a gap between them, with a merge at the point closest to the center."""
 
-    n = len(grid[0])  # Number of inputs
+        difference = abs(end - start)  # How many spaces between gates
 
-    for _ in range(n):
+        if difference % 2 != 0:  # Even amount of spaces
 
-        # A gate will come after any cell containing two wires, so any 'dual' cell or a merge cell.
-        connection_points = ["2", "4", "5", "6", "7"]
+            # The two center-most points
+            midpoints = start + direction * (difference // 2), start + direction * (difference // 2 + 1)
 
-        if grid[row - 1][_] in connection_points:  # If the cell directly behind is a connection point
-            grid[row][_] = GATE_GENER  # Add a random gate to the cell
+            # Determines where merge is placed (placed at point closest to center)
+            if abs(center_most - midpoints[0]) < abs(center_most - midpoints[1]):
+                closest_to_center = midpoints[0]
+            else:
+                closest_to_center = midpoints[1]
 
+        else:  # Odd amount of spaces
+            closest_to_center = start + direction * (difference // 2)  # Midpoint
 
-def bridge_gaps(grid: np.ndarray, gate_row: int, gate_index: int, action="pair"):
+        wires[closest_to_center] = WIRES["merge"]
+        wires[end] = end_wire
 
-    """Bridges any size gap between gates for easy wiring."""
+        # The rest become runs
+        for _ in range(min(start, end) + 1, max(start, end)):
+            if wires[_] == EMPTY:
+                wires[_] = WIRES["run"]
 
-    n = len(grid[0])  # Number of inputs
-    center_most = (n - 1) // 2  # Center most input
-    wire_row = gate_row + 1  # Row where wires are placed
+    def pair(bottom: int, top: int):
 
-    def the_beef(operation):
+        wires[bottom] = WIRES["curve up"]  # Gate always curves up
 
-        # Method of counting for next gate
-        if operation == operator.add:
-            next_gate_direction = range(gate_index + 1, n)  # Upward to the right
-            curve_extremity = WIRES["curve down"]  # Found gate curves down
+        if top - bottom == 1:  # Next to each other
+            if abs(center_most - bottom) > abs(center_most - top):  # Bottom gate closer
+                wires[bottom] = WIRES["dual bend down"]
+                wires[top] = WIRES["curve down"]
+            else:  # Top gate closer
+                wires[top] = WIRES["dual bend up"]
         else:
-            next_gate_direction = range(gate_index - 1, 0, -1)  # Downward to the left
-            curve_extremity = WIRES["curve up"]  # Found gate curves up
+            bridge(bottom, top, 1, WIRES["curve down"])
 
-        # Look for next gate
-        for _ in next_gate_direction:
-            if grid[gate_row][_] == GATE_GENER:
-                found_gate = _
-                break
+    def fork(bottom: int, middle: int, top: int):
 
-        difference = abs(gate_index - found_gate)  # How many spaces between gates
+        wires[middle] = WIRES["fork"]  # Gate is always forked
 
-        if difference == 1:  # Next to each other
+        # Top side
+        if top - middle == 1:
+            wires[top] = WIRES["dual bend up"]
+        else:
+            bridge(middle, top, 1, WIRES["curve down"])
 
-            if action == "pair":  # Pairing
-                if abs(center_most - gate_index) > abs(center_most - found_gate):  # Bottom gate closer
-                    grid[wire_row][gate_index] = WIRES["dual bend down"]
-                    grid[wire_row][found_gate] = WIRES["curve down"]
+        # Bottom side
+        if middle - bottom == 1:
+            wires[bottom] = WIRES["dual bend down"]
+        else:
+            bridge(middle, bottom, -1, WIRES["curve up"])
 
-                else:  # Top gate closer
-                    grid[wire_row][gate_index] = WIRES["curve up"]
-                    grid[wire_row][found_gate] = WIRES["dual bend up"]
+    num_of_gates = len(gates)
+    forked = num_of_gates  # Index of the forked gate, past the end if there isn't one
 
-            else:  # Forking
+    if num_of_gates % 2 != 0:  # If num_of_gates is odd
 
-                if operation == operator.add:  # Gate immediately right
-                    grid[wire_row][found_gate] = WIRES["dual bend up"]
-                else:  # Gate immediately left
-                    grid[wire_row][found_gate] = WIRES["dual bend down"]
+        forked = (num_of_gates - 1) // 2  # Center most gate
+        if ((num_of_gates - 1) // 2) % 2 == 0:  # If (num_of_gates - 1) / 2 is not odd
+            forked += 1  # We want to fork the gate just above the center-most gate
 
-        else:  # There is a space
-            if difference % 2 != 0:  # Even amount of spaces
+        fork(gates[forked - 1], gates[forked], gates[forked + 1])
 
-                # The two center-most points
-                midpoints = operation(gate_index, difference // 2), operation(gate_index, difference // 2 + 1)
+    # An even number of gates sits on each side of the fork, so the rest pair up in order
+    for _ in list(range(0, forked - 1, 2)) + list(range(forked + 2, num_of_gates, 2)):
+        pair(gates[_], gates[_ + 1])
 
-                # Determines where merge is placed (placed at point closest to center
-                if abs(center_most - midpoints[0]) < abs(center_most - midpoints[1]):
-                    closest_to_center = midpoints[0]
-                else:
-                    closest_to_center = midpoints[1]
+    return wires
 
-            else:  # Odd amount of spaces
-                closest_to_center = operation(gate_index, round(difference / 2))  # Midpoint
 
-            # Key points that stay consistent
-            grid[wire_row][closest_to_center] = WIRES["merge"]
-            grid[wire_row][found_gate] = curve_extremity
+def wire_grid(grid: np.ndarray) -> np.ndarray:
 
-            # Counting direction for adding runs
-            if operation == operator.add:
-                count_direction = range(gate_index, found_gate)  # Count UP from found gate
-            else:
-                count_direction = range(found_gate, gate_index)  # Count DOWN from found gate
+    """Wires the entire grid, one wire row and gate row at a time."""
 
-            # The rest become runs
-            for _ in count_direction:  # Count UP from found gate
-                if grid[wire_row][_] == " ":  # If the spot is empty
-                    grid[wire_row][_] = WIRES["run"]
+    n = len(grid[0])  # Number of inputs
 
-    if action == "pair":
+    # Wires the input row
+    grid[1] = wire_inputs(n)
+    row = 2
 
-        # Gate always curves up
-        grid[wire_row][gate_index] = WIRES["curve up"]
+    while True:
 
-        # Proceed in rightward direction
-        the_beef(operator.add)
+        # A gate will come after any cell containing two wires, so any 'dual' cell or a merge cell.
+        gates = np.flatnonzero(np.isin(grid[row - 1], CONNECTION_POINTS))
+        grid[row][gates] = GATE_GENER
 
-    else:  # Fork
+        # End condition: one single gate means we've reached the end of our schematic
+        if len(gates) == 1:
+            return grid
 
-        # Gate is always forked
-        grid[wire_row][gate_index] = WIRES["fork"]
+        grid[row + 1] = wire_gates(gates.tolist(), n)
+        row += 2
 
-        # Right side
-        the_beef(operator.add)
 
-        # Left side
-        the_beef(operator.sub)
+def count_gates(grid: np.ndarray):
 
+    """Counts the number of gates in a base grid."""
 
-def wire_gates(grid: np.ndarray, row: int):
+    return np.count_nonzero(grid == GATE_GENER)
 
-    """Wires logic gates together in the current row."""
 
-    row -= 1  # Quick fix so that I can pass the CURRENT row without rewriting the code lol
+def get_gate_coords(grid: np.ndarray) -> list[tuple[int, int]]:
 
-    n = len(grid[0])  # Number of inputs
-    num_of_gates = collections.Counter(grid[row])[GATE_GENER]  # Number of gates in the row
-    center_gate = (num_of_gates - 1) // 2 + 1  # Center most gate
+    """Gets the coordinates of every gate in a base schematic and returns them as a list."""
 
-    if num_of_gates % 2 != 0:  # If num_of_gates is odd
+    return [(row, column) for row, column in np.argwhere(grid == GATE_GENER).tolist()]  # In row order
 
-        if ((num_of_gates - 1) / 2) % 2 == 0:  # If (num_of_gates - 1) / 2 is not odd
-            center_gate += 1  # We want to fork the gate just above the center-most gate
 
-        gate_counter = 0  # Keep track of gates so we can find center-most gate
-        for _ in range(n):
+def seed_key(seed: int) -> bytes:
 
-            # Increase gate counter when we find a gate
-            if grid[row][_] == GATE_GENER:
-                gate_counter += 1
+    """Returns the permutation key for a seed, so runs with the same seed draw the same versions on any machine."""
 
-            # Center most gate found
-            if gate_counter == center_gate:
-                bridge_gaps(grid, row, _, action="fork")
-                break
+    return hashlib.shake_256(str(seed).encode()).digest(16)
 
-    # Now that all the forks have been placed and wired, I must wire pairs in the same way that is done for even
-    # numbers of gates
 
-    for _ in range(n):
-        if grid[row + 1][_] == " ":  # Gate is skipped if it's already wired
-            if grid[row][_] == GATE_GENER:  # Found a gate
-                bridge_gaps(grid, row, _)
+def mix(values: np.ndarray) -> np.ndarray:
 
+    """Scrambles 64 bit values with the splitmix64 finalizer, so that close values give unrelated results."""
 
-def wire_grid(grid: np.ndarray, row=1):
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)  # Wraps around, as intended
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
 
-    """Wires the entire grid."""
+    return values ^ (values >> np.uint64(31))
 
-    n = len(grid[0])  # Number of inputs
 
-    # Wires the input row
-    if row == 1:
-        wire_inputs(grid)
+def limb_sizes(gate_count: int) -> list[int]:
 
-    # Adds gates every second row (even numbered)
-    elif row % 2 == 0:
-        add_gates(grid, row)
+    """
+    Returns how many gates (digits of the gate order in base len(GATES)) are held in each limb, a 64 bit integer, when
+    gate orders are drawn in bulk. There are at least two limbs, so each can be scrambled by the others.
+    """
 
-        # End condition: one single gate means we've reached the end of our schematic
-        if collections.Counter(grid[row])[GATE_GENER] == 1:
-            return grid, row
+    limbs = max(min(2, gate_count), -(-gate_count // LIMB_DIGITS))
 
-    # Wires gates every second row (odd numbered)
-    else:
-        wire_gates(grid, row)
+    return [gate_count // limbs + (_ < gate_count % limbs) for _ in range(limbs)]
 
-    wire_grid(grid, row + 1)  # Once the action for the current row is complete, recursively call for the next row
 
+def permute_limbs(limbs: list[np.ndarray], moduli: list[int], key: bytes) -> list[np.ndarray]:
 
-def count_gates(grid: np.ndarray):
+    """
+    Maps gate orders, split into limbs, to different gate orders with a keyed Feistel network. Each round adds a keyed
+    hash of the other limbs to every limb in turn, wrapping around at its modulus. Every step can be undone, so every
+    key gives a bijection, and distinct gate orders always give distinct results.
+    """
 
-    """Counts the number of gates in a base grid."""
+    for _ in range(FEISTEL_ROUNDS):
+        for limb, modulus in enumerate(moduli):
 
-    gate_count = 0
-    for row in grid:
-        gate_count += collections.Counter(row)[GATE_GENER]
+            round_key = int.from_bytes(hashlib.shake_256(key + bytes([_, limb])).digest(8), "little")
+            hashed = np.full(len(limbs[limb]), round_key, dtype=np.uint64)
 
-    return gate_count
+            for other in range(len(limbs)):
+                if other != limb:
+                    hashed = mix(hashed ^ limbs[other])
 
+            limbs[limb] = (limbs[limb] + hashed % np.uint64(modulus)) % np.uint64(modulus)
 
-def get_gate_coords(grid: np.ndarray) -> list[tuple[int, int]]:
+    return limbs
 
-    """Gets the coordinates of every gate in a base schematic and returns them as a list."""
 
-    n, width = grid.shape  # # n is number of inputs
-    coords = []  # Tracks coordinates
+def gate_orders(positions: np.ndarray, gate_count: int, key: bytes, order="random") -> np.ndarray:
 
-    for row in range(n):  # Loop rows
-        for column in range(width):  # Loop columns
-            if grid[row][column] == GATE_GENER:  # Found a gate
-                coords.append((row, column))
+    """
+    Returns the gate orders at positions of the stream of gate orders picked by the key, as a (positions x gates) matrix
+    of gate symbols. Every gate order is a number in base len(GATES), where the first gate is the lowest digit, and is
+    worked out a limb at a time for every position at once. Random orders are shuffled by a keyed permutation. Gray
+    orders walk the reflected Gray code from a starting point picked by the key, so the orders at consecutive positions
+    differ in exactly one gate. Sequential orders count up from the same starting point.
+    """
 
-    return coords
+    sizes = limb_sizes(gate_count)
+    moduli = [len(GATES) ** _ for _ in sizes]
+    positions = np.array(positions, dtype=np.uint64)  # Copy, since it is divided down
+    limbs = []
 
+    if order == "random":
+        for modulus in moduli:
+            limbs.append(positions % np.uint64(modulus))
+            positions //= np.uint64(modulus)
+        limbs = permute_limbs(limbs, moduli, key)
 
-def add_random_gates(grid: np.ndarray, gate_coords: list[tuple[int, int]], gate_orders: list[tuple]) -> tuple:
+    else:  # Walks from the offset, carrying between limbs and wrapping around at the last gate order
+        offset = int.from_bytes(key, "little") % count_versions(gate_count)
+        carry = np.zeros(len(positions), dtype=np.uint64)
+        for modulus in moduli:
+            offset, part = divmod(offset, modulus)
+            total = positions % np.uint64(modulus) + np.uint64(part) + carry
+            positions //= np.uint64(modulus)
+            carry = (total >= modulus).astype(np.uint64)
+            limbs.append(total - carry * np.uint64(modulus))
 
-    """Adds random gates to a base grid and returns the grid and its combination of random gates in order as a tuple."""
+    # Each limb into its digits, lowest first
+    digits = np.empty((len(positions), gate_count), dtype=np.uint8)
+    column = 0
+    for limb, size in zip(limbs, sizes):
+        for _ in range(size):
+            digits[:, column] = limb % np.uint64(len(GATES))
+            limb = limb // np.uint64(len(GATES))
+            column += 1
 
-    fresh_grid = grid.copy()  # Create a copy of the grid so that our original isn't modified
+    if order == "gray":  # A digit runs backwards whenever the digit above it is odd
+        above = np.zeros_like(digits)
+        above[:, :-1] = digits[:, 1:]
+        digits = np.where(above % 2 == 1, len(GATES) - 1 - digits, digits)
 
-    while True:
+    return np.array(list(GATES.keys()), dtype=np.uint8)[digits]
 
-        gate_order = []  # Keeps track of the order random gates are placed in
 
-        for coordinate in gate_coords:  # Loop through coordinates
+def place_gates(grid: np.ndarray, gate_coords: list[tuple[int, int]], gate_order) -> np.ndarray:
 
-            row, column = coordinate  # Unpack values
+    """Returns a copy of a base grid with the gates of the gate order placed at the given coordinates."""
 
-            gate = random.choice((list(GATES.keys())))  # Pick a random gate
-            gate_order += [gate]  # Track the gate
-            fresh_grid[row][column] = gate  # Add it to the grid in place
+    fresh_grid = np.array(grid)  # Plain copy, so the original (which may be memory mapped) isn't modified
 
-        if not tuple(gate_order) in gate_orders:  # This gate order hasn't been generated yet
-            break
+    rows, columns = zip(*gate_coords)
+    fresh_grid[rows, columns] = gate_order  # Add them to the grid in place
 
-    return fresh_grid, tuple(gate_order)
+    return fresh_grid
 
 
 # Ensure no duplicates
@@ -316,11 +319,18 @@ def duplicate_detector(gate_orders: list[tuple[str]]) -> int:
 
 
 # Batch making
+def count_versions(gate_count: int) -> int:
+
+    """Returns the number of possible gate orders for a schematic with the given number of gates."""
+
+    return len(GATES) ** gate_count
+
+
 def validate_version_count(versions: int, gate_count: int, inputs: int):
 
     """Determines if there are enough permutations possible to create the specified number of versions."""
 
-    possible_versions = len(GATES) ** gate_count  # Total possible permutations
+    possible_versions = count_versions(gate_count)  # Total possible permutations
 
     # Formula explanation
     formula = "This is calculated using the formula 6^n, where n is the number of gates in a given schematic," \
@@ -339,36 +349,86 @@ def validate_version_count(versions: int, gate_count: int, inputs: int):
 
         quit()  # Quit
 
-    elif versions > possible_versions * 0.8 and inputs > 5:  # Random generation will take a while
 
-        print("Warning, generating this many versions randomly may be computationally expensive, as many duplicates will"
-              "likely be formed.")
+def gate_order_stream(gate_count: int, key: bytes, start=0, order="random"):
 
-        print("Remember that you can press Ctrl + C at any time to force the program to stop.")
+    """
+    Yields every possible gate order exactly once, in the order picked by the key, as rows of gate symbols drawn
+    GATE_ORDER_BLOCK at a time (see gate_orders). Starting partway through yields the same orders the full stream would
+    from that position on.
+    """
 
-        input("Press enter to continue.")
+    possible_versions = count_versions(gate_count)
 
+    for block in range(start, possible_versions, GATE_ORDER_BLOCK):
+        positions = np.arange(block, min(block + GATE_ORDER_BLOCK, possible_versions), dtype=np.uint64)
+        yield from gate_orders(positions, gate_count, key, order)
 
-def create_grid_batch(grid: np.ndarray, versions: int) -> dict:
 
-    """Creates a batch of grids to the specified quantity, and returns them numbered in a dictionary."""
+def grid_stream(grid: np.ndarray, versions: int, accept=None, checkpoint=None, order="random", key=None, first=0):
+
+    """
+    Yields (index, grid, table) for up to the specified number of random grids with distinct gate orders. If an accept
+    function is passed, candidate grids it returns None for are skipped and replaced with new ones, and whatever it
+    returns for accepted grids, such as their truth table, is yielded as the table. Otherwise the table is None, to be
+    evaluated later. If a checkpoint is
+    passed, its key and first index are used, the stream carries on from the versions it already holds, and every new
+    version is recorded in it. The order is one of ORDERS, and a key can be passed to pick the same versions every time.
+    Indices start at the first index, and the gate orders are drawn from the same position of the permutation, so runs
+    with the same key and different first indices draw disjoint versions unless an accept function skips some.
+    """
 
-    grids = {}  # Holds our random grids
-    gate_orders = []  # Holds the gate order for each random grid
     gate_coordinates = get_gate_coords(grid)  # Get the coordinates for the gates in the base grid
-    bar = IncrementalBar("Schematics", max=versions)
 
-    for _ in range(versions):  # Make as many as there are specified versions
+    if checkpoint is None:
+        key = random.randbytes(16) if key is None else key  # Picks which random permutation of the gate orders is used
+        index, start = first, first  # Index of the next grid, and position of the next gate order
+    else:
+        key, first, start = checkpoint.key, checkpoint.first, checkpoint.start
+        index = first + len(checkpoint.positions)
+    versions += first  # Index to stop at
+
+    # The permutation never repeats a number, so no gate order is drawn twice
+    for position, gate_order in enumerate(gate_order_stream(len(gate_coordinates), key, start, order), start):
+
+        if index == versions:  # Made as many as there are specified versions
+            return
+
+        new_grid = place_gates(grid, gate_coordinates, gate_order)
+        count("gate_orders_drawn")
+
+        table = accept(new_grid) if accept is not None else None
+        if accept is not None and table is None:  # Rejected candidate
+            count("versions_rejected")
+            continue
+
+        if checkpoint is not None:
+            checkpoint.record(position)
+
+        yield index, new_grid, table
+        index += 1
+
+    if index < versions:  # Every gate order was tried
+        status(f"\nOnly {index - first} of the requested versions could be created.")
+
+
+def create_grid_batch(grid: np.ndarray, versions: int, accept=None) -> dict:
+
+    """
+    Creates a batch of grids to the specified quantity, and returns them numbered in a dictionary. If an accept function
+    is passed, candidate grids it returns None for are skipped and replaced with new ones.
+    """
+
+    grids = {}  # Holds our random grids
+    bar = Progress("Schematics", versions)
+
+    for index, new_grid, _ in grid_stream(grid, versions, accept):
 
         # Progress display
         bar.next()
 
-        # Generate randomized grid and its gate order
-        new_grid, gate_order = add_random_gates(grid, gate_coordinates, gate_orders)
-
         # Store results
-        grids[_] = new_grid
-        gate_orders.append(gate_order)
+        grids[index] = new_grid
 
     bar.finish()
 
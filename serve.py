@@ -0,0 +1,24 @@
+# Runs the generator service
+__author__ = "Matteo Golin"
+
+# Imports
+from commands import serve_parser
+
+# Program parameters
+arguments = serve_parser.parse_args()
+
+# The service is only imported once the arguments are read, so -h doesn't wait for it
+import metrics
+from service import SERVICE_INPUTS, serve
+
+if arguments.warm and max(arguments.warm) > SERVICE_INPUTS:
+    serve_parser.error(f"at most {SERVICE_INPUTS} inputs are served (GOT: {max(arguments.warm)})")
+
+metrics.configure(arguments.metrics, arguments.quiet)
+
+try:
+    serve(arguments.port, arguments.cache, arguments.warm)
+except KeyboardInterrupt:  # Stopped
+    pass
+finally:
+    metrics.report()
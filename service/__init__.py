@@ -0,0 +1,200 @@
+# Long running generator service
+__author__ = "Matteo Golin"
+
+# Imports
+import argparse as ap
+import collections
+import io
+import os
+import random
+import re
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from commands import int_above_0, int_above_1
+from image import STATIC_LAYERS, encode_schematic, layer_key, load_assets, schematic_path, static_layer
+from karnaugh import Netlist, create_map_array, format_kmap, gate_code_matrix, kmap_path, map_from_table, \
+    truth_table_batch
+from layouts import load_layout
+from metrics import count, emit, status
+from schematic import count_versions, grid_stream, seed_key
+from settings import ORDERS, OUTPUT_FOLDER, RENDERERS
+
+# Constants
+SERVICE_HOST = "127.0.0.1"  # Only reachable from the same machine
+SERVICE_PORT = 8000
+LAYOUT_CACHE_SIZE = 8  # Input counts kept warm at once
+SERVICE_INPUTS = 16  # Largest schematics served
+SERVICE_VERSIONS = 1000  # Most versions served in one batch
+SERVICE_KMAP_CELLS = 2 ** 22  # Most Karnaugh map cells served in one batch, since every map is held in memory as text
+SERVICE_SCALE = 8  # Largest scalar served, since images grow with its square
+NAME_PATTERN = r"[\w .-]+"  # Batch names, which can't hold paths, quotes or line breaks
+
+
+class LayoutCache:
+
+    """
+    Wired base grids and netlists by input count, with their static image layers rendered, so repeated requests for
+    the same input count skip straight to drawing versions. Only the most recently used LAYOUT_CACHE_SIZE input counts
+    are kept, and the static layers of the others are dropped along with them.
+    """
+
+    def __init__(self, size=LAYOUT_CACHE_SIZE):
+
+        self.size = size
+        self.layouts = collections.OrderedDict()  # Least recently used first
+
+    def get(self, inputs: int) -> tuple[np.ndarray, Netlist]:
+
+        """Returns the base grid and netlist for the number of inputs, loading them if they aren't warm."""
+
+        if inputs in self.layouts:
+            self.layouts.move_to_end(inputs)
+            count("layout_cache_hits")
+            return self.layouts[inputs]
+
+        count("layout_cache_misses")
+        base_grid, netlist = load_layout(inputs)
+        static_layer(base_grid)  # Rendered once for every version of the layout
+        self.layouts[inputs] = base_grid, netlist
+
+        if len(self.layouts) > self.size:
+            _, (evicted, _) = self.layouts.popitem(last=False)
+            STATIC_LAYERS.pop(layer_key(evicted), None)
+
+        return base_grid, netlist
+
+
+def batch_archive(layouts: LayoutCache, inputs: int, versions: int, seed=None, scalar=1, renderer="paste",
+                  order="random", filename="batch") -> memoryview:
+
+    """
+    Makes a batch in memory, and returns it as a zip file holding the image and Karnaugh map of every version, named
+    and laid out as they would be in the output folder. Batches with the same seed and options are the same every time.
+    The zip file is returned without being copied out of the buffer it was written to.
+    """
+
+    base_grid, netlist = layouts.get(inputs)
+    key = random.randbytes(16) if seed is None else seed_key(seed)
+    grids = [(index, grid) for index, grid, _ in
+             grid_stream(base_grid, min(versions, count_versions(len(netlist.gates))), order=order, key=key)]
+    tables = truth_table_batch(netlist, gate_code_matrix(netlist, [grid for _, grid in grids]))
+    kmap = create_map_array(inputs)  # Base Karnaugh map
+
+    archive = io.BytesIO()
+
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as batch:  # Images are compressed already
+        for (index, grid), table in zip(grids, tables):
+            batch.writestr(os.path.relpath(schematic_path(filename, index), OUTPUT_FOLDER),
+                           encode_schematic(grid, index, scalar, renderer))
+            batch.writestr(os.path.relpath(kmap_path(filename, index), OUTPUT_FOLDER),
+                           format_kmap(map_from_table(kmap, table, inputs)))
+
+    return archive.getbuffer()
+
+
+def batch_options(query: str) -> dict:
+
+    """
+    Reads the options of a batch from a query string, such as inputs=4&versions=10&seed=3&scale=2. Raises
+    ArgumentTypeError if an option is missing or isn't valid.
+    """
+
+    fields = {name: values[-1] for name, values in parse_qs(query).items()}
+
+    for name in ("inputs", "versions"):
+        if name not in fields:
+            raise ap.ArgumentTypeError(f"The {name} option is required")
+
+    try:
+        seed = int(fields["seed"]) if "seed" in fields else None
+    except ValueError:
+        raise ap.ArgumentTypeError(f"Seed must be an integer. (GOT: {fields['seed']})")
+
+    options = {
+        "inputs": int_above_1(fields["inputs"]),
+        "versions": int_above_0(fields["versions"]),
+        "seed": seed,
+        "scalar": int_above_0(fields.get("scale", 1)),
+        "renderer": fields.get("renderer", "paste"),
+        "order": fields.get("order", "random"),
+        "filename": fields.get("name", "batch")
+    }
+
+    if options["inputs"] > SERVICE_INPUTS:
+        raise ap.ArgumentTypeError(f"At most {SERVICE_INPUTS} inputs are served. (GOT: {options['inputs']})")
+    if options["versions"] > SERVICE_VERSIONS:
+        raise ap.ArgumentTypeError(f"At most {SERVICE_VERSIONS} versions are served. (GOT: {options['versions']})")
+    if options["versions"] * 2 ** options["inputs"] > SERVICE_KMAP_CELLS:  # Each version has 2 ** inputs cells
+        raise ap.ArgumentTypeError(f"At most {SERVICE_KMAP_CELLS // 2 ** options['inputs']} versions of "
+                                   f"{options['inputs']} inputs are served. (GOT: {options['versions']})")
+    if options["scalar"] > SERVICE_SCALE:
+        raise ap.ArgumentTypeError(f"Images are scaled by at most {SERVICE_SCALE}. (GOT: {options['scalar']})")
+    if options["renderer"] not in RENDERERS:
+        raise ap.ArgumentTypeError(f"Renderer must be one of {', '.join(RENDERERS)}. (GOT: {options['renderer']})")
+    if options["order"] not in ORDERS:
+        raise ap.ArgumentTypeError(f"Order must be one of {', '.join(ORDERS)}. (GOT: {options['order']})")
+    if not re.fullmatch(NAME_PATTERN, options["filename"], re.ASCII):  # Goes into a header and the zip's file names
+        raise ap.ArgumentTypeError(f"Name can only hold letters, digits, spaces, underscores, dots and dashes. "
+                                   f"(GOT: {options['filename']})")
+
+    return options
+
+
+class BatchHandler(BaseHTTPRequestHandler):
+
+    """Answers GET /batch?inputs=...&versions=... with a zip file of the batch, made by batch_archive."""
+
+    layouts = LayoutCache()  # Shared by every request
+
+    def do_GET(self):
+
+        url = urlsplit(self.path)
+        if url.path != "/batch":
+            self.send_error(404, "Batches are made at /batch")
+            return
+
+        try:
+            options = batch_options(url.query)
+        except ap.ArgumentTypeError as error:
+            self.send_error(400, str(error).encode("unicode_escape").decode())  # Escaped, as it goes in the status line
+            return
+
+        start = time.perf_counter()
+        body = batch_archive(self.layouts, **options)
+        seconds = time.perf_counter() - start
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Disposition", f'attachment; filename="{options["filename"]}.zip"')
+        self.end_headers()
+        self.wfile.write(body)
+
+        count("requests_served")
+        count("bytes_served", len(body))
+        emit("request", **options, seconds=seconds, bytes=len(body))
+
+    def log_message(self, format, *args):
+
+        status(f"{self.address_string()} - {format % args}")  # Quiet mode silences requests too
+
+
+def serve(port=SERVICE_PORT, cache_size=LAYOUT_CACHE_SIZE, warm=()):
+
+    """
+    Serves batches over HTTP on the local machine until interrupted. Requests are answered one at a time, in the same
+    process, so sprites, layouts and static layers stay loaded between them. The input counts to warm are loaded before
+    the first request.
+    """
+
+    load_assets()  # Every sprite, decoded once
+    BatchHandler.layouts = LayoutCache(cache_size)
+    for inputs in warm:
+        BatchHandler.layouts.get(inputs)
+
+    with HTTPServer((SERVICE_HOST, port), BatchHandler) as server:
+        status(f"Serving batches at http://{SERVICE_HOST}:{port}/batch")
+        server.serve_forever()
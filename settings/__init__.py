@@ -0,0 +1,21 @@
+# Settings shared by the command line and the pipeline
+__author__ = "Matteo Golin"
+
+# Imports
+import json
+
+# Only the standard library is imported here, so reading the command line never waits for NumPy or Pillow
+
+# Folders
+ASSET_FOLDER = "assets"
+OUTPUT_FOLDER = "output"
+MANIFEST_FILE = f"{ASSET_FOLDER}/manifest.json"
+
+# Sprite file names, so assets can be listed and counted without opening any image
+with open(MANIFEST_FILE) as manifest_file:
+    MANIFEST = json.load(manifest_file)
+
+INPUT_LETTERS = len(MANIFEST["inputs"])  # Inputs with a single letter sprite
+ORDERS = ["random", "gray", "sequential"]  # Orders versions can be drawn in
+RENDERERS = ["paste", "atlas"]  # Ways a schematic can be drawn
+KMAP_WINDOW = 1000  # Default number of versions pulled from a stream at once
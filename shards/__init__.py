@@ -0,0 +1,169 @@
+# Splitting one job across processes and machines
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+import re
+import numpy as np
+from archive import ArchiveReader, ArchiveWriter, archive_path
+from checkpoints import load_checkpoint, version_complete
+from image import schematic_path
+from karnaugh import kmap_path
+from layouts import layout_version, load_layout
+from schematic import gate_orders
+from settings import OUTPUT_FOLDER
+
+# Constants
+SHARD_PATTERN = r"\.shard-(\d+)-of-(\d+)(\.checkpoint)?\.npz"  # Follows the file name of a saved shard
+
+
+def shard_name(filename: str, shard: int, shards: int) -> str:
+
+    """Returns the name that a shard's checkpoint or archive is saved under."""
+
+    return f"{filename}.shard-{shard}-of-{shards}"
+
+
+def shard_range(versions: int, shard: int, shards: int) -> range:
+
+    """
+    Returns the indices of the versions made by a shard (numbered from 1) of a job split into the number of shards.
+    Every shard gets a run of consecutive indices, and the sizes of any two shards differ by at most one.
+    """
+
+    return range(versions * (shard - 1) // shards, versions * shard // shards)
+
+
+def find_shards(filename: str, folder=OUTPUT_FOLDER) -> tuple[dict, set]:
+
+    """
+    Returns the paths of the saved shards of a job by shard number, and every shard count they were split into. A
+    shard's archive is used over its checkpoint, since it holds more.
+    """
+
+    pattern = re.compile(re.escape(filename) + SHARD_PATTERN)
+    paths, counts = {}, set()
+
+    for name in os.listdir(folder):
+
+        match = pattern.fullmatch(name)
+        if match is None:  # Not a shard of this job
+            continue
+
+        shard, shards, checkpoint = int(match[1]), int(match[2]), match[3]
+        counts.add(shards)
+
+        if shard not in paths or not checkpoint:
+            paths[shard] = f"{folder}/{name}"
+
+    return paths, counts
+
+
+def shard_versions(filename: str, path: str) -> tuple:
+
+    """
+    Returns the base grid, netlist, version indices and gates of a saved shard, along with an archive reader if the
+    shard is an archive, and the number of versions in the whole job if the shard holds it. The versions of a
+    checkpoint are drawn again from its key, and must all have their files.
+    """
+
+    if not path.endswith(".checkpoint.npz"):
+        reader = ArchiveReader(path)
+        return reader.grid, reader.netlist, np.asarray(reader.arrays["index"]), reader.arrays["gates"], reader, \
+            reader.total
+
+    checkpoint = load_checkpoint(path)
+    version, inputs, order = checkpoint.layout.split("/")
+
+    if version != layout_version():
+        raise ValueError(f"{path} was made with a different version of the layout code")
+    if checkpoint.unique:
+        raise ValueError(f"{path} skipped versions with -unique, so its numbering isn't shared with other shards")
+
+    grid, netlist = load_layout(int(inputs))
+    indices = np.arange(checkpoint.first, checkpoint.first + len(checkpoint.positions), dtype=np.int64)
+    gates = gate_orders(np.array(checkpoint.positions, dtype=np.uint64), len(netlist.gates), checkpoint.key, order)
+
+    # The shard made the same kinds of files for every version as for its first
+    kmaps = len(indices) > 0 and os.path.isfile(kmap_path(filename, indices[0]))
+    images = len(indices) > 0 and os.path.isfile(schematic_path(filename, indices[0]))
+    missing = [_ for _ in indices.tolist() if not (kmaps or images) or not version_complete(filename, _, kmaps, images)]
+
+    if missing:
+        raise ValueError(f"{path} is missing the files of {len(missing)} versions, from #{missing[0] + 1}, so the "
+                         f"shard must be resumed first")
+
+    return grid, netlist, indices, gates, None, checkpoint.total
+
+
+def merge_shards(filename: str, folder=OUTPUT_FOLDER) -> int:
+
+    """
+    Checks that every shard of a job has been saved with all of its versions, so that together they hold every version
+    of the job exactly once, and that no gate order was made by more than one shard. Then puts the versions of every
+    shard together into one archive for the job, in version order. Truth tables and images are included if every shard
+    is an archive holding them. Raises ValueError if the shards don't fit together, and returns the number of versions
+    merged.
+    """
+
+    paths, counts = find_shards(filename, folder)
+
+    if not paths:
+        raise ValueError(f"there are no shards of {filename} in {folder}")
+    if len(counts) > 1:
+        raise ValueError(f"the shards of {filename} were split in different ways: {sorted(counts)}")
+
+    shards = counts.pop()
+    missing = sorted(set(range(1, shards + 1)) - set(paths))
+    if missing:
+        raise ValueError(f"shards {', '.join(map(str, missing))} of {shards} haven't been saved")
+
+    keys = {load_checkpoint(path).key for path in paths.values() if path.endswith(".checkpoint.npz")}
+    if len(keys) > 1:
+        raise ValueError("the shards were drawn with different seeds, so their versions can overlap")
+
+    parts = [shard_versions(filename, paths[_]) for _ in range(1, shards + 1)]
+    grid, netlist = parts[0][0], parts[0][1]
+
+    if any(not np.array_equal(part[0], grid) for part in parts):
+        raise ValueError("the shards were made with different layouts")
+
+    totals = {part[5] for part in parts}
+    if None in totals:
+        raise ValueError("some shards don't hold the number of versions in the job, so they can't be checked for gaps")
+    if len(totals) > 1:
+        raise ValueError(f"the shards were made for different numbers of versions: {sorted(totals)}")
+
+    total = totals.pop()
+    for shard, part in enumerate(parts, 1):  # Each shard must hold exactly its slice of the job
+        expected = shard_range(total, shard, shards)
+        if not np.array_equal(part[2], np.arange(expected.start, expected.stop)):
+            raise ValueError(f"shard {shard} of {shards} holds {len(part[2])} versions rather than versions "
+                             f"#{expected.start + 1} to #{expected.stop}, so it must be resumed or made again")
+
+    indices = np.concatenate([part[2] for part in parts])
+    gates = np.concatenate([part[3] for part in parts])
+
+    if not np.array_equal(np.sort(indices), np.arange(total)):
+        raise ValueError(f"the shards don't hold every version from #1 to #{total} exactly once")
+    if len(np.unique(gates, axis=0)) < len(gates):
+        raise ValueError("some gate orders were made by more than one shard")
+
+    readers = [part[4] for part in parts]
+    tables = all(reader is not None and "tables" in reader.arrays for reader in readers)
+    images = all(reader is not None and "png" in reader.arrays for reader in readers)
+    sources = [(shard, row) for shard, part in enumerate(parts) for row in range(len(part[2]))]  # Where each one is
+
+    with ArchiveWriter(archive_path(filename), grid, netlist, total) as archive:
+        for position in np.argsort(indices, kind="stable").tolist():
+
+            shard, row = sources[position]
+            archive.add_gates(int(indices[position]), gates[position])
+
+            if tables:
+                archive.add_table(readers[shard].arrays["tables"][row])
+            if images:
+                number = int(indices[position]) + 1
+                archive.add_image(readers[shard].image(number))
+
+    return len(indices)
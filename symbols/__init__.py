@@ -0,0 +1,73 @@
+# Symbol table for schematic grids
+__author__ = "Matteo Golin"
+
+# Imports
+import numpy as np
+
+# Grids are uint8 arrays where each cell holds one of these codes
+EMPTY = 0
+INPUT = 1  # Which input is found from the column, so one code covers every input
+GATE_GENER = 2  # Generic gate symbol
+WIRES = {
+    "fork": 3,
+    "merge": 4,
+    "run": 5,
+    "dual up": 6,
+    "dual down": 7,
+    "dual bend up": 8,
+    "dual bend down": 9,
+    "curve up": 10,
+    "curve down": 11
+}
+GATES = {
+    12: "and",
+    13: "nand",
+    14: "or",
+    15: "nor",
+    16: "xnor",
+    17: "xor"
+}
+
+# Character form of each code, for debugging output
+CHARACTERS = {
+    EMPTY: " ",
+    GATE_GENER: "□",
+    WIRES["fork"]: u'\u2524',
+    WIRES["merge"]: "2",
+    WIRES["run"]: "|",
+    WIRES["dual up"]: "4",
+    WIRES["dual down"]: "5",
+    WIRES["dual bend up"]: "6",
+    WIRES["dual bend down"]: "7",
+    WIRES["curve up"]: u'\u2518',
+    WIRES["curve down"]: u'\u2510',
+    12: "&",
+    13: "*",
+    14: ")",
+    15: "(",
+    16: "%",
+    17: "^"
+}
+
+
+def to_characters(grid: np.ndarray, input_names: list[str]) -> np.ndarray:
+
+    """Returns a coded grid in character form, with each input written as its name."""
+
+    characters = np.array([CHARACTERS.get(code, "?") for code in range(256)], dtype=object)[grid]
+
+    # Inputs are named from the last column, which is the first input
+    width = grid.shape[1]
+    for column in np.flatnonzero(grid[0] == INPUT):
+        characters[0][column] = input_names[(width - 1 - column) % len(input_names)]
+
+    return characters
+
+
+def from_characters(characters: np.ndarray) -> np.ndarray:
+
+    """Returns the coded form of a grid written in characters. Anything that isn't a known character is an input."""
+
+    codes = {character: code for code, character in CHARACTERS.items()}
+
+    return np.vectorize(lambda character: codes.get(character, INPUT), otypes=[np.uint8])(characters)
@@ -0,0 +1,104 @@
+# Background file writing
+__author__ = "Matteo Golin"
+
+# Imports
+import contextlib
+import os
+import queue
+import threading
+from metrics import count
+
+# Constants
+WRITE_QUEUE = 64  # Files waiting to be written before producers have to wait
+TEMPORARY_PATTERN = r"(.+)\.\d+\.tmp"  # Follows the path a temporary file is written for
+
+
+@contextlib.contextmanager
+def replacing(path: str):
+
+    """
+    Gives a temporary path to write a file at, which replaces the file at the path once the block finishes. A file only
+    ever exists at the path once it is complete, even if the program is killed partway through, and the temporary file
+    is removed if writing it fails.
+    """
+
+    temporary = f"{path}.{os.getpid()}.tmp"  # Processes sharing a folder never write the same temporary file
+
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+class Writer:
+
+    """
+    Writes files on background threads, so generating the next file overlaps with writing the last one. Files wait in a
+    bounded queue, so a slow disk holds producers back instead of letting encoded files pile up in memory. Failed writes
+    don't stop the batch, and are reported together when the writer is closed.
+    """
+
+    def __init__(self, threads=1, queue_size=WRITE_QUEUE):
+        self.queue = queue.Queue(maxsize=queue_size)  # (path, contents) pairs
+        self.failures = []  # (path, error) pairs
+        self.threads = [threading.Thread(target=self.drain, daemon=True) for _ in range(threads)]
+
+        for thread in self.threads:
+            thread.start()
+
+    def drain(self):
+
+        """Writes files from the queue until it is told to stop. Each file is written through replacing."""
+
+        while (item := self.queue.get()) is not None:
+
+            path, contents = item
+
+            try:
+                with replacing(path) as temporary, \
+                        open(temporary, "wb" if isinstance(contents, bytes) else "w") as file:  # Encoded or text file
+                    if isinstance(contents, (str, bytes)):
+                        file.write(contents)
+                    else:
+                        file.writelines(contents)  # Text made a chunk at a time
+                    written = file.tell()
+            except Exception as error:  # Anything, so the thread keeps draining and producers never wait forever
+                self.failures.append((path, error))
+                count("write_failures")
+            else:
+                count("files_written")
+                count("bytes_written", written)
+
+    def write(self, path: str, contents):
+
+        """
+        Queues a file to be written, waiting for room if the queue is full. The contents are bytes, text, or an iterable
+        of text chunks, which is consumed on the writer thread so large files never have to be held in memory.
+        """
+
+        self.queue.put((path, contents))
+
+    def close(self):
+
+        """Waits for every queued file to be written, then reports the files that couldn't be."""
+
+        for _ in self.threads:
+            self.queue.put(None)  # One stop signal per thread, after every file
+
+        for thread in self.threads:
+            thread.join()
+
+        for path, error in self.failures:
+            print(f"Failed to write {path} for reason: {error}")
+
+        if self.failures:
+            raise OSError(f"{len(self.failures)} files could not be written.") from self.failures[0][1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()